@@ -0,0 +1,716 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+"""
+Offline benchmarks for the NDVI forecast pipeline on synthetic rasters and weather.
+Records wall time (best of `repeat` runs), throughput and peak traced memory.
+
+Run from the ndvi_forecast folder, e.g.
+    python -m benchmarks.run_benchmarks --benchmarks ard weather --farm-sizes 0.5 1 --output results/benchmarks.csv
+"""
+
+# Standard library imports
+import argparse
+import itertools
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import tracemalloc
+import warnings
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+# Third party imports
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.windows import Window
+
+# Local imports
+from benchmarks.synthetic_data import (REVISIT_DAYS, FakeFarmBeatsClient, SyntheticBoundary,
+                                       make_weather_data, write_sat_file_links)
+from utils.ard_util import ard_preprocess, ard_preprocess_tiled, read_sat_data_array, smooth_and_interpolate
+from utils.boundary_sync import BoundarySync, get_client_endpoint
+from utils.cog_util import COGWriter, CogUtil
+from utils.constants import CONSTANTS
+from utils.grid_cache import GridCache
+from utils.incremental_ard import IncrementalARD
+from utils.satellite_util import SatelliteUtil
+from utils.tile_util import TileUtil
+from utils.weather_cache import WeatherCache
+from utils.weather_util import WeatherUtil
+
+# Library specific imports
+from azure.core.exceptions import ResourceNotFoundError
+from azure.agrifood.farming.models import Boundary, Polygon
+
+
+SEASON_START = datetime.strptime(CONSTANTS["interp_date_start"], "%d-%m-%Y")
+FARMER_ID = "bench_farmer"
+LON, LAT = -97.0652, 46.6627  # first farm of farms_sample_1kmx1km.csv
+BOUNDARY_SPACING_DEG = 0.05
+# scoring_file module globals replaced by the scoring benchmark
+SCORING_GLOBALS = (
+    "model", "w_parms", "weather_mean", "weather_std", "call_farmbeats",
+    "grid_cache", "incremental_ard", "weather_caches",
+)
+
+
+def measure(func, repeat, setup=None):
+    """
+    Runs func `repeat` times and once more under tracemalloc.
+    :param setup: optional untimed function called before each run, its result is passed to func
+    :return: best wall time in seconds, peak traced memory in MB and the last result
+    """
+    times = []
+    for _ in range(repeat):
+        args = () if setup is None else (setup(),)
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    args = () if setup is None else (setup(),)
+    tracemalloc.start()
+    result = func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak / (1000 * 1000), result
+
+
+def held_memory(func):
+    """
+    Runs func once under tracemalloc and keeps its result alive.
+    :return: traced memory in MB still allocated after the run (mostly the result) and the result
+    """
+    tracemalloc.start()
+    result = func()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / (1000 * 1000), result
+
+
+def record(benchmark, seconds, peak_mb, units, unit, **params):
+    """ Result row with throughput as processed units (pixels, records, scenes) per second """
+    row = {"benchmark": benchmark}
+    row.update(params)
+    row.update({
+        "seconds": round(seconds, 4),
+        "units": units,
+        "unit": unit,
+        "units_per_s": round(units / seconds, 2) if seconds > 0 else np.nan,
+        "peak_mb": round(peak_mb, 2),
+    })
+    print(row)
+    return row
+
+
+def season_end(scene_count):
+    return SEASON_START + timedelta(days=REVISIT_DAYS * (scene_count - 1))
+
+
+def bench_ard(args, work_dir, w_parms, w_mn, w_sd):
+    rows = []
+    for farm_size, scene_count in itertools.product(args.farm_sizes, args.scene_counts):
+        boundary = SyntheticBoundary("bench-ard", LON, LAT, farm_size, seed=args.seed)
+        sat_links = write_sat_file_links(boundary, work_dir, SEASON_START, scene_count, FARMER_ID)
+        end_dt = season_end(scene_count)
+        w_df = WeatherUtil.get_weather_data_df(
+            make_weather_data(boundary.boundary_id, SEASON_START, end_dt, w_parms, w_mn, w_sd, seed=args.seed)
+        )
+        boundary_geometry = boundary.multipolygon_geojson() if args.polygon_mask else None
+        # grid is built once outside of the timed runs, as for repeated scoring of a boundary
+        grid = GridCache().get(boundary.boundary_id, sat_links) if args.grid_cache else None
+        for sat_res_x in args.sat_res:
+            seconds, peak_mb, ard = measure(
+                lambda: ard_preprocess(
+                    boundary_geometry=boundary_geometry,
+                    grid=grid,
+                    sat_file_links=sat_links.copy(),
+                    w_df=w_df.copy(),
+                    sat_res_x=sat_res_x,
+                    var_name=CONSTANTS["var_name"],
+                    interp_date_start=SEASON_START,
+                    interp_date_end=end_dt,
+                    w_parms=w_parms,
+                    input_days=CONSTANTS["input_days"],
+                    output_days=CONSTANTS["output_days"],
+                    ref_tm=SEASON_START.strftime("%d-%m-%Y"),
+                    w_mn=w_mn,
+                    w_sd=w_sd,
+                ),
+                args.repeat,
+            )
+            pixels = len(range(0, boundary.height, sat_res_x)) * len(range(0, boundary.width, sat_res_x))
+            rows.append(record(
+                "ard_preprocess", seconds, peak_mb, pixels, "pixels",
+                farm_size_km=farm_size, sat_res_x=sat_res_x, scene_count=scene_count,
+                boundary_count=1, polygon_mask=args.polygon_mask, grid_cache=args.grid_cache,
+                ard_rows=ard.shape[0],
+            ))
+    return rows
+
+
+def bench_ard_tiled(args, work_dir, w_parms, w_mn, w_sd):
+    rows = []
+    scene_count = max(args.scene_counts)
+    end_dt = season_end(scene_count)
+    for farm_size in args.farm_sizes:
+        boundary = SyntheticBoundary("bench-ard", LON, LAT, farm_size, seed=args.seed)
+        sat_links = write_sat_file_links(boundary, work_dir, SEASON_START, scene_count, FARMER_ID)
+        w_df = WeatherUtil.get_weather_data_df(
+            make_weather_data(boundary.boundary_id, SEASON_START, end_dt, w_parms, w_mn, w_sd, seed=args.seed)
+        )
+        for sat_res_x, tile_size in itertools.product(args.sat_res, args.tile_sizes):
+            # tiles are consumed one by one, as in scoring, so only a tile's ARD is alive at a time
+            seconds, peak_mb, ard_rows = measure(
+                lambda: sum(ard.shape[0] for _, ard in ard_preprocess_tiled(
+                    sat_links,
+                    sat_res_x=sat_res_x,
+                    tile_size=tile_size,
+                    max_workers=args.tile_workers,
+                    w_df=w_df,
+                    var_name=CONSTANTS["var_name"],
+                    interp_date_start=SEASON_START,
+                    interp_date_end=end_dt,
+                    w_parms=w_parms,
+                    input_days=CONSTANTS["input_days"],
+                    output_days=CONSTANTS["output_days"],
+                    ref_tm=SEASON_START.strftime("%d-%m-%Y"),
+                    w_mn=w_mn,
+                    w_sd=w_sd,
+                )),
+                args.repeat,
+            )
+            pixels = len(range(0, boundary.height, sat_res_x)) * len(range(0, boundary.width, sat_res_x))
+            rows.append(record(
+                "ard_preprocess_tiled", seconds, peak_mb, pixels, "pixels",
+                farm_size_km=farm_size, sat_res_x=sat_res_x, scene_count=scene_count, boundary_count=1,
+                tile_size=tile_size, tile_workers=args.tile_workers, ard_rows=ard_rows,
+            ))
+    return rows
+
+
+def bench_ard_incremental(args, work_dir, w_parms, w_mn, w_sd):
+    """ Appending one scene to a boundary's incremental state, against a full ard_preprocess """
+    rows = []
+    for farm_size, scene_count in itertools.product(args.farm_sizes, args.scene_counts):
+        boundary = SyntheticBoundary("bench-inc", LON, LAT, farm_size, seed=args.seed)
+        sat_links = write_sat_file_links(boundary, work_dir, SEASON_START, scene_count + 1, FARMER_ID)
+        sat_links = sat_links.sort_values("sceneDateTime").reset_index(drop=True)
+        end_dt = season_end(scene_count + 1)
+        w_df = WeatherUtil.get_weather_data_df(make_weather_data(
+            boundary.boundary_id, SEASON_START, end_dt + timedelta(days=CONSTANTS["output_days"]),
+            w_parms, w_mn, w_sd, seed=args.seed
+        ))
+        ref_tm = (end_dt - timedelta(days=CONSTANTS["input_days"] - 1)).strftime("%d-%m-%Y")
+        for sat_res_x in args.sat_res:
+            ard_parms = dict(
+                var_name=CONSTANTS["var_name"],
+                w_parms=w_parms,
+                input_days=CONSTANTS["input_days"],
+                output_days=CONSTANTS["output_days"],
+                w_mn=w_mn,
+                w_sd=w_sd,
+            )
+
+            def setup():
+                # state of the first scene_count scenes, built outside of the timed runs
+                incremental = IncrementalARD(sat_res_x=sat_res_x, **ard_parms)
+                incremental.append_scenes(boundary.boundary_id, sat_links.iloc[:scene_count])
+                return incremental
+
+            def append(incremental):
+                incremental.append_scenes(boundary.boundary_id, sat_links)
+                return incremental, incremental.get_ard(boundary.boundary_id, w_df, ref_tm=ref_tm)
+
+            seconds, peak_mb, (incremental, ard) = measure(append, args.repeat, setup)
+            full_seconds, full_peak_mb, full_ard = measure(
+                lambda: ard_preprocess(
+                    sat_file_links=sat_links, w_df=w_df, sat_res_x=sat_res_x, interp_date_start=SEASON_START,
+                    interp_date_end=end_dt, ref_tm=ref_tm, **ard_parms
+                ),
+                args.repeat,
+            )
+            # deviation of the latest input window from a full recompute
+            full_inter = smooth_and_interpolate(
+                read_sat_data_array(sat_links, sat_res_x, CONSTANTS["var_name"]), SEASON_START, end_dt
+            )
+            window = full_inter.index[-CONSTANTS["input_days"]:]
+            max_abs_diff = np.nanmax(np.abs(
+                incremental.get_interpolated(boundary.boundary_id).loc[window].values - full_inter.loc[window].values
+            ))
+            pixels = len(range(0, boundary.height, sat_res_x)) * len(range(0, boundary.width, sat_res_x))
+            params = dict(farm_size_km=farm_size, sat_res_x=sat_res_x, scene_count=scene_count + 1, boundary_count=1)
+            rows.append(record(
+                "ard_incremental_append", seconds, peak_mb, pixels, "pixels",
+                ard_rows=ard.shape[0], max_abs_diff=round(float(max_abs_diff), 6), **params
+            ))
+            rows.append(record(
+                "ard_full_recompute", full_seconds, full_peak_mb, pixels, "pixels",
+                ard_rows=full_ard.shape[0], **params
+            ))
+    return rows
+
+
+def bench_ard_compact(args, work_dir, w_parms, w_mn, w_sd):
+    """
+    ARD DataFrame against CompactARD (float32, and float16 weather): build time, peak memory,
+    memory held by the result, and copies made when assembling model inputs
+    """
+    rows = []
+    scene_count = max(args.scene_counts)
+    end_dt = season_end(scene_count)
+    for farm_size in args.farm_sizes:
+        boundary = SyntheticBoundary("bench-compact", LON, LAT, farm_size, seed=args.seed)
+        sat_links = write_sat_file_links(boundary, work_dir, SEASON_START, scene_count, FARMER_ID)
+        w_df = WeatherUtil.get_weather_data_df(
+            make_weather_data(boundary.boundary_id, SEASON_START, end_dt, w_parms, w_mn, w_sd, seed=args.seed)
+        )
+        for sat_res_x, (layout, weather_dtype) in itertools.product(
+            args.sat_res, [("dataframe", None), ("compact", "float32"), ("compact", "float16")]
+        ):
+            compact = layout == "compact"
+
+            def build():
+                return ard_preprocess(
+                    sat_file_links=sat_links,
+                    w_df=w_df,
+                    sat_res_x=sat_res_x,
+                    var_name=CONSTANTS["var_name"],
+                    interp_date_start=SEASON_START,
+                    interp_date_end=end_dt,
+                    w_parms=w_parms,
+                    input_days=CONSTANTS["input_days"],
+                    output_days=CONSTANTS["output_days"],
+                    ref_tm=SEASON_START.strftime("%d-%m-%Y"),
+                    w_mn=w_mn,
+                    w_sd=w_sd,
+                    compact=compact,
+                    weather_dtype=weather_dtype or "float32",
+                )
+
+            seconds, peak_mb, _ = measure(build, args.repeat)
+            held_mb, ard = held_memory(build)
+            # model inputs, as assembled for prediction
+            start = time.perf_counter()
+            if compact:
+                inputs = ard.get_model_inputs()
+                buffers = [ard.input_evi, ard.input_weather, ard.forecast_weather]
+                copies = sum(not any(np.shares_memory(x, y) for y in buffers) for x in inputs)
+            else:
+                inputs = [np.array(ard[x].to_list()) for x in ["input_evi", "input_weather", "forecast_weather"]]
+                copies = len(inputs)
+            assembly_seconds = time.perf_counter() - start
+            pixels = len(range(0, boundary.height, sat_res_x)) * len(range(0, boundary.width, sat_res_x))
+            rows.append(record(
+                "ard_" + layout, seconds, peak_mb, pixels, "pixels",
+                farm_size_km=farm_size, sat_res_x=sat_res_x, scene_count=scene_count, boundary_count=1,
+                weather_dtype=weather_dtype, ard_rows=len(ard), held_mb=round(held_mb, 2),
+                input_copies=copies, input_mb=round(sum(x.nbytes for x in inputs) / (1000 * 1000), 2),
+                assembly_seconds=round(assembly_seconds, 4),
+            ))
+    return rows
+
+
+def bench_ard_sliding(args, work_dir, w_parms, w_mn, w_sd):
+    """ Sliding window samples per stride: build time, memory held and batch assembly time """
+    rows = []
+    scene_count = max(args.scene_counts)
+    end_dt = season_end(scene_count)
+    for farm_size, sat_res_x in itertools.product(args.farm_sizes, args.sat_res):
+        boundary = SyntheticBoundary("bench-sliding", LON, LAT, farm_size, seed=args.seed)
+        sat_links = write_sat_file_links(boundary, work_dir, SEASON_START, scene_count, FARMER_ID)
+        w_df = WeatherUtil.get_weather_data_df(
+            make_weather_data(boundary.boundary_id, SEASON_START, end_dt, w_parms, w_mn, w_sd, seed=args.seed)
+        )
+        for stride in args.strides:
+
+            def build():
+                return ard_preprocess(
+                    sat_file_links=sat_links,
+                    w_df=w_df,
+                    sat_res_x=sat_res_x,
+                    var_name=CONSTANTS["var_name"],
+                    interp_date_start=SEASON_START,
+                    interp_date_end=end_dt,
+                    w_parms=w_parms,
+                    input_days=CONSTANTS["input_days"],
+                    output_days=CONSTANTS["output_days"],
+                    ref_tm=SEASON_START.strftime("%d-%m-%Y"),
+                    w_mn=w_mn,
+                    w_sd=w_sd,
+                    stride=stride,
+                )
+
+            seconds, peak_mb, _ = measure(build, args.repeat)
+            held_mb, ard = held_memory(build)
+            valid = np.flatnonzero(ard.quality == 0)
+            # windows are copied batch by batch, as when feeding a model
+            batch_seconds, batch_peak_mb, batches = measure(
+                lambda: sum(1 for _ in ard.iter_batches(args.batch_size, index=valid, shuffle=True, seed=args.seed)),
+                args.repeat,
+            )
+            rows.append(record(
+                "ard_sliding_window", seconds, peak_mb, len(ard), "samples",
+                farm_size_km=farm_size, sat_res_x=sat_res_x, scene_count=scene_count, boundary_count=1,
+                stride=stride, valid_samples=len(valid), held_mb=round(held_mb, 2), batches=batches,
+                batch_seconds=round(batch_seconds, 4), batch_peak_mb=round(batch_peak_mb, 2),
+            ))
+    return rows
+
+
+def bench_cog(args, work_dir, w_parms, w_mn, w_sd):
+    """
+    Forecast output as one GeoTIFF per day against one multi-band COG (whole raster and
+    streamed per tile): write time, file count, bytes and read latency of a 64 x 64 window
+    over all forecast days
+    """
+    rows = []
+    label_names = [(SEASON_START + timedelta(days=i + 1)).strftime("%Y-%m-%d") for i in range(CONSTANTS["output_days"])]
+    for farm_size in args.farm_sizes:
+        boundary = SyntheticBoundary("bench-cog", LON, LAT, farm_size, seed=args.seed)
+        profile = boundary.profile
+        raster = np.stack([boundary.ndvi_scene(SEASON_START + timedelta(days=i)) for i in range(len(label_names))])
+        raster = np.where(boundary.field_mask, raster, np.nan).astype("float32")
+        out_dir = tempfile.mkdtemp(dir=work_dir, prefix="cog_")
+        window = Window(0, 0, min(64, boundary.width), min(64, boundary.height))
+
+        def write_per_day():
+            paths = []
+            for band, coln in enumerate(label_names):
+                paths.append(os.path.join(out_dir, coln + ".tif"))
+                with rasterio.open(paths[-1], "w", **dict(profile, dtype="float32")) as dst:
+                    dst.write(raster[band], indexes=1)
+            return paths
+
+        def read_per_day(paths):
+            bands = []
+            for path in paths:
+                with rasterio.open(path) as src:
+                    bands.append(src.read(1, window=window))
+            return np.stack(bands)
+
+        def write_streamed():
+            path = os.path.join(out_dir, "forecast_streamed.tif")
+            with COGWriter(path, profile, label_names) as dst:
+                for tile in TileUtil.get_tile_windows(boundary.height, boundary.width, args.tile_sizes[0]):
+                    dst.write_window(raster[(slice(None),) + tile.toslices()], tile)
+            return [path]
+
+        def read_cog(paths):
+            with rasterio.open(paths[0]) as src:
+                return src.read(window=window)
+
+        for layout, write, read in [
+            ("per_day_tif", write_per_day, read_per_day),
+            ("cog", lambda: [CogUtil.write_cog(os.path.join(out_dir, "forecast.tif"), raster, profile, label_names)],
+             read_cog),
+            ("cog_streamed", write_streamed, read_cog),
+        ]:
+            seconds, peak_mb, paths = measure(write, args.repeat)
+            read_seconds, _, _ = measure(lambda: read(paths), args.repeat)
+            rows.append(record(
+                "forecast_" + layout, seconds, peak_mb, boundary.height * boundary.width, "pixels",
+                farm_size_km=farm_size, files=len(paths), file_mb=round(sum(map(os.path.getsize, paths)) / 1e6, 3),
+                read_seconds=round(read_seconds, 5),
+            ))
+    return rows
+
+
+def bench_weather(args, work_dir, w_parms, w_mn, w_sd):
+    rows = []
+    for scene_count, boundary_count in itertools.product(args.scene_counts, args.boundary_counts):
+        weather_data = [
+            make_weather_data("bench-w" + str(i), SEASON_START, season_end(scene_count),
+                              w_parms, w_mn, w_sd, seed=args.seed + i)
+            for i in range(boundary_count)
+        ]
+        seconds, peak_mb, _ = measure(
+            lambda: [WeatherUtil.get_weather_data_df(x) for x in weather_data], args.repeat
+        )
+        rows.append(record(
+            "weather_data_df", seconds, peak_mb, sum(len(x) for x in weather_data), "records",
+            scene_count=scene_count, boundary_count=boundary_count,
+        ))
+    return rows
+
+
+def bench_satellite(args, work_dir, w_parms, w_mn, w_sd):
+    rows = []
+    for farm_size, scene_count, boundary_count in itertools.product(
+        args.farm_sizes, args.scene_counts, args.boundary_counts
+    ):
+        client = FakeFarmBeatsClient(w_parms, w_mn, w_sd, seed=args.seed)
+        boundaries = [
+            client.add_boundary(
+                FARMER_ID, "bench-sat" + str(i),
+                SyntheticBoundary("bench-sat" + str(i), LON + i * BOUNDARY_SPACING_DEG, LAT, farm_size).geometry,
+            )
+            for i in range(boundary_count)
+        ]
+        runs = itertools.count()
+
+        def download():
+            # fresh directory per run, as already downloaded images are skipped
+            root_dir = tempfile.mkdtemp(dir=work_dir, prefix="sat{}_".format(next(runs)))
+            return SatelliteUtil(farmbeats_client=client).download_and_get_sat_file_paths(
+                FARMER_ID, boundaries, SEASON_START, season_end(scene_count), root_dir
+            )
+
+        seconds, peak_mb, sat_links = measure(download, args.repeat)
+        rows.append(record(
+            "satellite_download", seconds, peak_mb, sat_links.shape[0], "scenes",
+            farm_size_km=farm_size, scene_count=scene_count, boundary_count=boundary_count,
+        ))
+    return rows
+
+
+def bench_weather_cache(args, work_dir, w_parms, w_mn, w_sd):
+    """
+    Historical and forecast weather of 1 km farms on a grid spaced --farm-spacing degrees:
+    listed and converted per boundary against read through a WeatherCache per weather cell size.
+    Provider calls are the weather.list calls of the fake client, ingestion jobs are one per
+    boundary or one per cell.
+    """
+    rows = []
+    start_dt, end_dt = SEASON_START, season_end(max(args.scene_counts))
+    for boundary_count, cell_size in itertools.product(args.weather_boundaries, args.weather_cell_deg):
+        client = FakeFarmBeatsClient(w_parms, w_mn, w_sd, seed=args.seed)
+        side = int(np.ceil(np.sqrt(boundary_count)))
+        boundaries = OrderedDict()
+        for i in range(boundary_count):
+            boundary_id = "bench-w{}".format(i)
+            lon, lat = LON + (i % side) * args.farm_spacing, LAT + (i // side) * args.farm_spacing
+            boundaries[boundary_id] = SyntheticBoundary(boundary_id, lon, lat, 1.0).geometry
+            client.add_boundary(FARMER_ID, boundary_id, boundaries[boundary_id])
+        runs = itertools.count()
+
+        def per_boundary():
+            for boundary_id in boundaries:
+                for weather_data_type, start, end in [("historical", start_dt, end_dt), ("forecast", end_dt, end_dt + timedelta(days=10))]:
+                    WeatherUtil.get_weather_data_df(list(client.weather.list(
+                        farmer_id=FARMER_ID, boundary_id=boundary_id, start_date_time=start, end_date_time=end,
+                        extension_id="", weather_data_type=weather_data_type, granularity="daily",
+                    )))
+            return len(boundaries)
+
+        def cached():
+            # empty cache directory per run
+            weather_cache = WeatherCache(
+                cache_dir=os.path.join(work_dir, "weather{}_{}".format(boundary_count, next(runs))),
+                cell_size_deg=cell_size, extension_id="bench", endpoint=get_client_endpoint(client),
+            )
+            cells = len(weather_cache.register_boundaries(FARMER_ID, boundaries))
+            for boundary_id in boundaries:
+                weather_cache.get_weather_df(client, FARMER_ID, boundary_id, "historical", start_dt, end_dt)
+                weather_cache.get_weather_df(
+                    client, FARMER_ID, boundary_id, "forecast", end_dt, end_dt + timedelta(days=10)
+                )
+            return cells
+
+        for mode, func in [("per_boundary", per_boundary), ("cached", cached)]:
+            client.calls.clear()
+            seconds, peak_mb, fetch_units = measure(func, args.repeat)
+            rows.append(record(
+                "weather_" + mode, seconds, peak_mb, boundary_count, "boundaries",
+                boundary_count=boundary_count, cell_deg=cell_size, farm_spacing_deg=args.farm_spacing,
+                cells=fetch_units if mode == "cached" else np.nan, ingestion_jobs=2 * fetch_units,
+                weather_list_calls=client.calls["weather.list"] // (args.repeat + 1),
+            ))
+    return rows
+
+
+def bench_boundary_sync(args, work_dir, w_parms, w_mn, w_sd):
+    """
+    Boundary onboarding of farms_sample_1kmx1km.csv rows: one by one get and create (as the
+    download notebook did) against BoundarySync on first run, re-run and with 10% changed
+    geometries. Boundary calls of the fake client sleep --latency seconds.
+    """
+    rows = []
+    csv_path = os.path.join("data", "farms_sample_1kmx1km.csv")
+    for boundary_count in args.sync_counts:
+        rings = list(BoundarySync.read_boundaries_csv(csv_path).values())
+        boundaries = OrderedDict(("boundary" + str(i), rings[i % len(rings)]) for i in range(boundary_count))
+        changed = OrderedDict(boundaries)
+        for boundary_id in list(changed)[::10]:
+            changed[boundary_id] = [[lon + 0.001, lat] for lon, lat in changed[boundary_id]]
+        runs = itertools.count()
+
+        def new_sync():
+            client = FakeFarmBeatsClient(w_parms, w_mn, w_sd, seed=args.seed, latency=args.latency)
+            manifest_path = os.path.join(work_dir, "boundary_manifest{}_{}.json".format(boundary_count, next(runs)))
+            return BoundarySync(client, manifest_path=manifest_path, max_workers=args.sync_workers)
+
+        def synced():
+            boundary_sync = new_sync()
+            boundary_sync.sync(FARMER_ID, boundaries)
+            boundary_sync.fb_client.calls.clear()
+            return boundary_sync
+
+        def one_by_one(client):
+            # one get (not found) and create call per boundary
+            for boundary_id, boundary_polygon in boundaries.items():
+                try:
+                    client.boundaries.get(farmer_id=FARMER_ID, boundary_id=boundary_id)
+                except ResourceNotFoundError:
+                    client.boundaries.create_or_update(
+                        farmer_id=FARMER_ID, boundary_id=boundary_id,
+                        boundary=Boundary(description="Created by SDK", geometry=Polygon(coordinates=[boundary_polygon])),
+                    )
+            return client
+
+        def sync(boundary_sync, boundaries):
+            result = boundary_sync.sync(FARMER_ID, boundaries)
+            return boundary_sync.fb_client, result
+
+        for mode, func, setup in [
+            ("one_by_one", one_by_one, lambda: FakeFarmBeatsClient(w_parms, w_mn, w_sd, seed=args.seed,
+                                                                   latency=args.latency)),
+            ("sync_first", lambda x: sync(x, boundaries), new_sync),
+            ("sync_rerun", lambda x: sync(x, boundaries), synced),
+            ("sync_changed", lambda x: sync(x, changed), synced),
+        ]:
+            seconds, peak_mb, result = measure(func, args.repeat, setup=setup)
+            client, sync_result = result if isinstance(result, tuple) else (result, None)
+            rows.append(record(
+                "boundary_" + mode, seconds, peak_mb, boundary_count, "boundaries",
+                boundary_count=boundary_count, latency=args.latency, sync_workers=args.sync_workers,
+                api_calls=sum(client.calls[x] for x in client.calls if x.startswith("boundaries.")),
+                **(sync_result.to_dict() if sync_result else {})
+            ))
+    return rows
+
+
+class StubModel:
+    """ Persistence forecast with the keras predict() interface """
+
+    def __init__(self, output_days):
+        self.output_days = output_days
+
+    def predict(self, inputs):
+        return np.repeat(inputs[0][:, -1:, :], self.output_days, axis=1)
+
+
+def bench_scoring(args, work_dir, w_parms, w_mn, w_sd):
+    try:
+        from utils import scoring_file
+    except ImportError as e:
+        print("Skipping scoring benchmark: {}".format(e))
+        return []
+
+    rows = []
+    root_dir = CONSTANTS["root_dir"]
+    # module globals replaced while benchmarking, restored (or removed if init() did not set them) after
+    saved_globals = {x: getattr(scoring_file, x) for x in SCORING_GLOBALS if hasattr(scoring_file, x)}
+    CONSTANTS["root_dir"] = work_dir
+    scoring_file.model = StubModel(CONSTANTS["output_days"])
+    scoring_file.w_parms, scoring_file.weather_mean, scoring_file.weather_std = w_parms, w_mn, w_sd
+    # caches of the benchmark boundaries, the weather cache is created under work_dir on first use
+    scoring_file.grid_cache, scoring_file.incremental_ard, scoring_file.weather_caches = GridCache(), None, {}
+    try:
+        # tile size 0 scores the whole boundary at once
+        for farm_size, boundary_count, tile_size in itertools.product(
+            args.farm_sizes, args.boundary_counts, [0] + args.tile_sizes
+        ):
+            client = FakeFarmBeatsClient(w_parms, w_mn, w_sd, seed=args.seed)
+            scoring_file.call_farmbeats = lambda config: client
+            requests = []
+            for i in range(boundary_count):
+                boundary_id = "bench-score{}-{}".format(farm_size, i)
+                geometry = SyntheticBoundary(boundary_id, LON + i * BOUNDARY_SPACING_DEG, LAT, farm_size).geometry
+                client.add_boundary(FARMER_ID, boundary_id, geometry)
+                requests.append(json.dumps({
+                    "config": {}, "farmer_id": FARMER_ID,
+                    "boundary_id": boundary_id, "bonudary_geometry": geometry,
+                    "tile_size": tile_size, "tile_workers": args.tile_workers,
+                }))
+
+            seconds, peak_mb, results = measure(lambda: [scoring_file.run(x) for x in requests], args.repeat)
+            errors = [x for x in results if not isinstance(x, dict)]
+            if errors:
+                print("Scoring returned errors: {}".format(errors))
+            pixels = sum(len(pd.DataFrame(x["model_preds"])) for x in results if isinstance(x, dict))
+            rows.append(record(
+                "scoring_run", seconds, peak_mb, pixels, "pixels",
+                farm_size_km=farm_size, sat_res_x=1, boundary_count=boundary_count,
+                tile_size=tile_size, tile_workers=args.tile_workers, errors=len(errors),
+            ))
+    finally:
+        CONSTANTS["root_dir"] = root_dir
+        for name in SCORING_GLOBALS:
+            if name in saved_globals:
+                setattr(scoring_file, name, saved_globals[name])
+            elif hasattr(scoring_file, name):
+                delattr(scoring_file, name)
+    return rows
+
+
+BENCHMARKS = {
+    "ard": bench_ard,
+    "ard_tiled": bench_ard_tiled,
+    "ard_incremental": bench_ard_incremental,
+    "ard_compact": bench_ard_compact,
+    "ard_sliding": bench_ard_sliding,
+    "cog": bench_cog,
+    "weather": bench_weather,
+    "weather_cache": bench_weather_cache,
+    "boundary_sync": bench_boundary_sync,
+    "satellite": bench_satellite,
+    "scoring": bench_scoring,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the NDVI forecast pipeline on synthetic data")
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--farm-sizes", nargs="+", type=float, default=[0.5, 1.0], help="farm side in km")
+    parser.add_argument("--sat-res", nargs="+", type=int, default=[1, 10, 20], help="sat_res_x values")
+    parser.add_argument("--scene-counts", nargs="+", type=int, default=[12, 24])
+    parser.add_argument("--boundary-counts", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--polygon-mask", action="store_true",
+                        help="mask ard_preprocess pixels with an irregular MultiPolygon field")
+    parser.add_argument("--grid-cache", action="store_true",
+                        help="reuse cached grid metadata and always zero mask in ard_preprocess")
+    parser.add_argument("--tile-sizes", nargs="+", type=int, default=[64], help="tile sizes in pixels")
+    parser.add_argument("--tile-workers", type=int, default=1)
+    parser.add_argument("--strides", nargs="+", type=int, default=[5, 10, 40],
+                        help="days between sliding window starts, 40 (input + output days) gives no overlap")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--weather-boundaries", nargs="+", type=int, default=[100])
+    parser.add_argument("--weather-cell-deg", nargs="+", type=float, default=[0.05, 0.1],
+                        help="weather cell sizes in degrees")
+    parser.add_argument("--farm-spacing", type=float, default=0.01, help="degrees between farms")
+    parser.add_argument("--sync-counts", nargs="+", type=int, default=[200], help="boundaries to onboard")
+    parser.add_argument("--sync-workers", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds per fake boundary call")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="csv file to write the results to")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    warnings.filterwarnings("ignore")
+    with open(CONSTANTS["w_pkl"], "rb") as f:
+        w_parms, w_mn, w_sd = pickle.load(f)
+
+    work_dir = tempfile.mkdtemp(prefix="farmbeats_bench_")
+    try:
+        rows = []
+        for name in args.benchmarks:
+            rows.extend(BENCHMARKS[name](args, work_dir, w_parms, w_mn, w_sd))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = pd.DataFrame(rows)
+    print(results.to_string(index=False))
+    if args.output:
+        results.to_csv(args.output, index=False)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+"""
+Synthetic satellite and weather data, and a fake FarmBeats client,
+so that the NDVI pipeline can be benchmarked offline without credentials
+"""
+
+# Standard library imports
+import json
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from threading import Lock
+from urllib.parse import quote
+
+# Third party imports
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.io import MemoryFile
+from rasterio.transform import from_origin
+
+# Library specific imports
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+
+
+PIXEL_DEG = 0.0000898  # ~10 m Sentinel-2 pixel in degrees
+REVISIT_DAYS = 5  # Sentinel-2 revisit time
+CLOUDY_EVERY = 7  # every n-th scene is reported as cloudy and filtered out downstream
+FILE_LINK = "https://fake.farmbeats.azure.net/scenes/downloadFiles?api-version=2021-03-31-preview&filePath="
+
+
+class SyntheticBoundary:
+    """
+    Synthetic farm boundary which renders NDVI scenes on a 10 m EPSG:4326 grid.
+    Pixels within `border` pixels of the edge are always zero (outside the field),
+    cloudy pixels are zero in a given scene.
+    """
+
+    def __init__(self, boundary_id, lon, lat, farm_size_km, seed=0, cloud_fraction=0.1, border=2):
+        self.boundary_id = boundary_id
+        self.height = self.width = max(int(round(farm_size_km * 1000 / 10)), border * 2 + 1)
+        self.transform = from_origin(lon, lat + self.height * PIXEL_DEG, PIXEL_DEG, PIXEL_DEG)
+        self.seed = seed
+        self.cloud_fraction = cloud_fraction
+
+        lon_max = lon + self.width * PIXEL_DEG
+        lat_max = lat + self.height * PIXEL_DEG
+        self.geometry = [[lon, lat], [lon_max, lat], [lon_max, lat_max], [lon, lat_max], [lon, lat]]
+
+        # smooth spatial vigor field, so neighbouring pixels behave alike
+        rows, cols = np.mgrid[0:self.height, 0:self.width] / max(self.height, self.width)
+        phase = np.random.RandomState(seed).uniform(0, 2 * np.pi, 2)
+        self.vigor = 0.9 + 0.1 * np.sin(6 * rows + phase[0]) * np.cos(4 * cols + phase[1])
+
+        self.field_mask = np.zeros((self.height, self.width), dtype=bool)
+        self.field_mask[border:-border, border:-border] = True
+
+    def multipolygon_geojson(self):
+        """ Irregular field as geojson MultiPolygon of two corner triangles, covering a quarter of the scene """
+        (lon, lat), (lon_max, _), (_, lat_max) = self.geometry[:3]
+        lon_mid, lat_mid = (lon + lon_max) / 2, (lat + lat_max) / 2
+        return json.dumps({
+            "type": "MultiPolygon",
+            "coordinates": [
+                [[[lon, lat], [lon_mid, lat], [lon, lat_mid], [lon, lat]]],
+                [[[lon_max, lat_max], [lon_mid, lat_max], [lon_max, lat_mid], [lon_max, lat_max]]],
+            ],
+        })
+
+    @classmethod
+    def from_geometry(cls, boundary_id, geometry, seed=0):
+        """ Creates a synthetic boundary covering the bounding box of a polygon ring """
+        coords = np.array(geometry)
+        lon_min, lat_min = coords.min(axis=0)
+        lon_max, lat_max = coords.max(axis=0)
+        farm_size_km = max(lon_max - lon_min, lat_max - lat_min) / PIXEL_DEG * 10 / 1000
+        return cls(boundary_id, lon_min, lat_min, farm_size_km, seed=seed)
+
+    @property
+    def profile(self):
+        return {
+            "driver": "GTiff",
+            "dtype": "float32",
+            "nodata": None,
+            "width": self.width,
+            "height": self.height,
+            "count": 1,
+            "crs": rasterio.crs.CRS.from_epsg(4326),
+            "transform": self.transform,
+        }
+
+    def ndvi_scene(self, scene_date):
+        """ Renders NDVI for a date as yearly phenology x vigor + noise, with clouds and border zeroed """
+        rng = np.random.RandomState((self.seed * 100003 + scene_date.toordinal()) % (2 ** 31))
+        doy = scene_date.timetuple().tm_yday
+        phenology = 0.45 + 0.3 * np.sin(2 * np.pi * (doy - 120) / 365.0)
+        ndvi = phenology * self.vigor + rng.normal(0, 0.03, self.vigor.shape)
+
+        # clouds as a few random discs covering roughly cloud_fraction of the scene
+        rows, cols = np.mgrid[0:self.height, 0:self.width]
+        clouds = np.zeros(ndvi.shape, dtype=bool)
+        radius = max(self.height, self.width) * np.sqrt(self.cloud_fraction / 3 / np.pi)
+        for r, c in zip(rng.randint(0, self.height, 3), rng.randint(0, self.width, 3)):
+            clouds |= (rows - r) ** 2 + (cols - c) ** 2 < radius ** 2
+
+        return np.where(self.field_mask & ~clouds, np.clip(ndvi, -1, 1), 0).astype("float32")
+
+    def write_scene(self, out_path, scene_date):
+        Path(out_path).parent.mkdir(parents=True, exist_ok=True)
+        with rasterio.open(out_path, "w", **self.profile) as dst:
+            dst.write(self.ndvi_scene(scene_date), indexes=1)
+        return out_path
+
+    def scene_bytes(self, scene_date):
+        with MemoryFile() as memfile:
+            with memfile.open(**self.profile) as dst:
+                dst.write(self.ndvi_scene(scene_date), indexes=1)
+            return memfile.read()
+
+
+def scene_dates(start_date, end_date):
+    """ Sentinel-2 like acquisition dates between start and end date (both inclusive) """
+    first = start_date.toordinal() + (-start_date.toordinal()) % REVISIT_DAYS
+    return [datetime.fromordinal(x) for x in range(first, end_date.toordinal() + 1, REVISIT_DAYS)]
+
+
+def scene_file_path(farmer_id, boundary_id, scene_date):
+    return "Microsoft/Sentinel_2_L2A/{}/{}/{}/00-00-00/ndvi_10.tif".format(
+        farmer_id, boundary_id, scene_date.strftime("%Y-%m-%d")
+    )
+
+
+def write_sat_file_links(boundary, root_dir, start_date, scene_count, farmer_id="bench_farmer"):
+    """
+    Writes scene_count NDVI GeoTIFFs for a synthetic boundary and returns
+    satellite file links in the format of SatelliteUtil.download_and_get_sat_file_paths
+    """
+    dates = [start_date + timedelta(days=REVISIT_DAYS * i) for i in range(scene_count)]
+    file_paths = []
+    for scene_date in dates:
+        out_path = Path(os.path.join(root_dir, scene_file_path(farmer_id, boundary.boundary_id, scene_date)))
+        if not out_path.exists():
+            boundary.write_scene(out_path, scene_date)
+        file_paths.append(out_path)
+    return pd.DataFrame(
+        {
+            "name": "NDVI",
+            "resolution": 10.0,
+            "sceneDateTime": [x.strftime("%Y-%m-%dT00:00:00Z") for x in dates],
+            "boundaryId": boundary.boundary_id,
+            "cloudCoverPercentage": 0.0,
+            "darkPixelPercentage": 0.0,
+            "boundary_count": scene_count,
+            "filePath": file_paths,
+        }
+    )
+
+
+class FakeWeatherData:
+    """ Weather record with the serialize() interface of the FarmBeats SDK models """
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def serialize(self):
+        return self.payload
+
+
+def make_weather_data(boundary_id, start_date, end_date, w_parms, w_mn, w_sd,
+                      weather_data_type="historical", seed=0):
+    """
+    Daily weather records between start and end date (both inclusive) whose
+    flattened columns match the `weather_parms` schema, e.g. 'airTempMin-F'.
+    Values follow the training normalization statistics w_mn and w_sd.
+    """
+    w_mn = np.ravel(w_mn)
+    w_sd = np.ravel(w_sd)
+    names_units = [x.split("-", 1) for x in w_parms]
+    dates = pd.date_range(start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))
+    rng = np.random.RandomState(seed)
+    season = np.sin(2 * np.pi * (dates.dayofyear.values - 120) / 365.0)[:, np.newaxis]
+    values = w_mn + w_sd * (0.5 * season + 0.5 * rng.normal(size=(len(dates), len(w_mn))))
+
+    weather_data = []
+    for date, row in zip(dates, values):
+        properties = {name: {"unit": unit, "value": float(v)} for (name, unit), v in zip(names_units, row)}
+        # ClearAg returns 'n/a' for unsupported measures, which are dropped by WeatherUtil
+        properties["soilMoisture"] = {"unit": "%", "value": "n/a"}
+        weather_data.append(FakeWeatherData({
+            "boundaryId": boundary_id,
+            "dateTime": date.strftime("%Y-%m-%dT00:00:00Z"),
+            "weatherDataType": weather_data_type,
+            "granularity": "daily",
+            "properties": properties,
+        }))
+    return weather_data
+
+
+class _FakeConfiguration:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+
+
+class _FakeGeometry:
+    def __init__(self, coordinates):
+        self.coordinates = coordinates
+
+
+class _FakeBoundary:
+    def __init__(self, farmer_id, boundary_id, coordinates):
+        self.id = boundary_id
+        self.farmer_id = farmer_id
+        # polygon with a single ring, as in azure.agrifood.farming.models.Polygon
+        self.geometry = _FakeGeometry([coordinates])
+
+    def as_dict(self):
+        return {"id": self.id, "farmerId": self.farmer_id, "geometry": {"coordinates": self.geometry.coordinates}}
+
+
+class _FakeJob:
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def as_dict(self):
+        return {"id": self.job_id, "status": "Succeeded"}
+
+
+class _FakePoller:
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def result(self):
+        return _FakeJob(self.job_id)
+
+    def status(self):
+        return "Succeeded"
+
+
+class _FakeImageFile:
+    def __init__(self, file_link):
+        self.file_link = file_link
+        self.name = "NDVI"
+        self.resolution = 10.0
+
+    def serialize(self):
+        return {"fileLink": self.file_link, "name": self.name, "resolution": self.resolution}
+
+
+class _FakeScene:
+    def __init__(self, scene_id, boundary_id, scene_date, file_link, cloud_cover):
+        self.id = scene_id
+        self.boundary_id = boundary_id
+        self.scene_date_time = scene_date
+        self.cloud_cover_percentage = cloud_cover
+        self.image_files = [_FakeImageFile(file_link)]
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "sceneDateTime": self.scene_date_time.strftime("%Y-%m-%dT00:00:00Z"),
+            "boundaryId": self.boundary_id,
+            "cloudCoverPercentage": self.cloud_cover_percentage,
+            "darkPixelPercentage": 0.0,
+            "imageFiles": [x.serialize() for x in self.image_files],
+        }
+
+
+class _FakeFarmersOperations:
+    def __init__(self, client):
+        self._client = client
+
+    def get(self, farmer_id):
+        self._client.count("farmers.get")
+        if farmer_id not in self._client.farmer_ids:
+            raise ResourceNotFoundError("Farmer '{}' not found".format(farmer_id))
+        return farmer_id
+
+    def create_or_update(self, farmer_id, farmer):
+        self._client.count("farmers.create_or_update")
+        self._client.farmer_ids.add(farmer_id)
+        return farmer
+
+
+class _FakeBoundariesOperations:
+    def __init__(self, client):
+        self._client = client
+
+    def get(self, farmer_id, boundary_id):
+        self._client.count("boundaries.get")
+        self._client.wait()
+        if (farmer_id, boundary_id) not in self._client.boundaries_store:
+            raise ResourceNotFoundError("Boundary '{}' not found".format(boundary_id))
+        return self._client.boundaries_store[(farmer_id, boundary_id)]
+
+    def create_or_update(self, farmer_id, boundary_id, boundary):
+        self._client.count("boundaries.create_or_update")
+        self._client.wait()
+        self._client.raise_error("boundaries.create_or_update")
+        existing = self._client.boundaries_store.get((farmer_id, boundary_id))
+        coordinates = boundary.geometry.coordinates[0]
+        # as the service, the geometry of an existing boundary can not be changed
+        if existing is not None and existing.geometry.coordinates[0] != coordinates:
+            raise HttpResponseError("Boundary '{}' exists with another geometry".format(boundary_id))
+        return self._client.add_boundary(farmer_id, boundary_id, coordinates)
+
+    def begin_create_cascade_delete_job(self, job_id, farmer_id, boundary_id):
+        self._client.count("boundaries.begin_create_cascade_delete_job")
+        self._client.wait()
+        self._client.boundaries_store.pop((farmer_id, boundary_id), None)
+        self._client.synthetic_boundaries.pop((farmer_id, boundary_id), None)
+        return _FakePoller(job_id)
+
+
+class _FakeScenesOperations:
+    def __init__(self, client):
+        self._client = client
+
+    def begin_create_satellite_data_ingestion_job(self, job_id, job, polling=True):
+        self._client.count("scenes.begin_create_satellite_data_ingestion_job")
+        return _FakePoller(job_id)
+
+    def list(self, farmer_id, boundary_id, start_date_time=None, end_date_time=None, image_names=None):
+        self._client.count("scenes.list")
+        self._client.boundaries.get(farmer_id, boundary_id)
+        scenes = []
+        for i, scene_date in enumerate(scene_dates(start_date_time, end_date_time)):
+            file_link = FILE_LINK + quote(scene_file_path(farmer_id, boundary_id, scene_date), safe="")
+            cloud_cover = 30.0 if i % CLOUDY_EVERY == CLOUDY_EVERY - 1 else 0.0
+            scene_id = "{}-{}".format(boundary_id, scene_date.strftime("%Y%m%d"))
+            scenes.append(_FakeScene(scene_id, boundary_id, scene_date, file_link, cloud_cover))
+        return iter(scenes)
+
+    def download(self, file_path):
+        self._client.count("scenes.download")
+        _, _, farmer_id, boundary_id, date_str, _, _ = file_path.split("/")
+        boundary = self._client.synthetic_boundaries[(farmer_id, boundary_id)]
+        data = boundary.scene_bytes(datetime.strptime(date_str, "%Y-%m-%d"))
+        return iter([data[i:i + 65536] for i in range(0, len(data), 65536)])
+
+
+class _FakeWeatherOperations:
+    def __init__(self, client):
+        self._client = client
+
+    def begin_create_data_ingestion_job(self, job_id, job, polling=True):
+        self._client.count("weather.begin_create_data_ingestion_job")
+        return _FakePoller(job_id)
+
+    def list(self, farmer_id, boundary_id, extension_id, weather_data_type, granularity,
+             start_date_time=None, end_date_time=None, **kwargs):
+        self._client.count("weather.list")
+        self._client.boundaries.get(farmer_id, boundary_id)
+        today = datetime.strptime(datetime.now().strftime("%Y-%m-%d"), "%Y-%m-%d")
+        if weather_data_type == "forecast":
+            start_date_time = start_date_time or today
+            end_date_time = end_date_time or today + timedelta(days=10)
+        else:
+            # historical data is available up to yesterday, forecast starts today
+            start_date_time = start_date_time or today - timedelta(days=60)
+            end_date_time = min(end_date_time or today, today - timedelta(days=1))
+        return iter(make_weather_data(
+            boundary_id, start_date_time, end_date_time,
+            self._client.w_parms, self._client.w_mn, self._client.w_sd,
+            weather_data_type=weather_data_type, seed=self._client.seed,
+        ))
+
+
+class FakeFarmBeatsClient:
+    """
+    In-memory stand-in for azure.agrifood.farming.FarmBeatsClient covering the
+    operations used by the NDVI forecast utils. Scenes and weather are synthesized
+    on request for any registered boundary and date range, and every call is
+    counted in `calls`. Boundary calls sleep `latency` seconds, as a stand-in for the
+    service round trip. Exceptions queued in `errors[operation]` are raised by the next
+    calls of that operation, e.g. to simulate throttling.
+    """
+
+    def __init__(self, w_parms, w_mn, w_sd, seed=0, latency=0.0, endpoint="https://fake.farmbeats.azure.net"):
+        # endpoint is read from the client configuration, as in FarmBeatsClient
+        self._config = _FakeConfiguration(endpoint)
+        self.w_parms = w_parms
+        self.w_mn = w_mn
+        self.w_sd = w_sd
+        self.seed = seed
+        self.latency = latency
+        self.calls = Counter()
+        self._calls_lock = Lock()
+        self.errors = {}
+        self.farmer_ids = set()
+        self.boundaries_store = {}
+        self.synthetic_boundaries = {}
+
+        self.farmers = _FakeFarmersOperations(self)
+        self.boundaries = _FakeBoundariesOperations(self)
+        self.scenes = _FakeScenesOperations(self)
+        self.weather = _FakeWeatherOperations(self)
+
+    def count(self, operation):
+        with self._calls_lock:
+            self.calls[operation] += 1
+
+    def raise_error(self, operation):
+        with self._calls_lock:
+            errors = self.errors.get(operation)
+            error = errors.pop(0) if errors else None
+        if error is not None:
+            raise error
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def add_boundary(self, farmer_id, boundary_id, coordinates):
+        """ Registers a boundary (polygon ring) without counting it as an API call """
+        self.farmer_ids.add(farmer_id)
+        boundary = _FakeBoundary(farmer_id, boundary_id, coordinates)
+        self.boundaries_store[(farmer_id, boundary_id)] = boundary
+        self.synthetic_boundaries[(farmer_id, boundary_id)] = SyntheticBoundary.from_geometry(
+            boundary_id, coordinates, seed=self.seed
+        )
+        return boundary
@@ -0,0 +1,9 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+# Standard library imports
+import os
+import sys
+
+# modules are imported as utils.x and benchmarks.x, from the ndvi_forecast folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,141 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+# Standard library imports
+import json
+
+# Third party imports
+import pytest
+
+# Local imports
+from benchmarks.synthetic_data import FakeFarmBeatsClient
+from utils.boundary_sync import BoundarySync, get_geometry_hash
+
+# Library specific imports
+from azure.core.exceptions import HttpResponseError
+
+
+FARMER_ID = "test_farmer"
+LON, LAT, SIZE = -97.0652, 46.6627, 0.0005
+
+
+def ring(dx=0.0):
+    lon, lat = LON + dx, LAT
+    return [[lon, lat], [lon + SIZE, lat], [lon + SIZE, lat + SIZE], [lon, lat + SIZE], [lon, lat]]
+
+
+@pytest.fixture
+def client():
+    return FakeFarmBeatsClient([], [], [])
+
+
+@pytest.fixture
+def manifest_path(tmp_path):
+    return str(tmp_path / "boundary_manifest.json")
+
+
+def boundary_calls(client):
+    return {k: v for k, v in client.calls.items() if k.startswith("boundaries.")}
+
+
+def test_geometry_hash_ignores_orientation_start_and_closing_vertex():
+    closed = ring()
+    reordered = [closed[2], closed[1], closed[0], closed[3]]
+    assert get_geometry_hash(closed) == get_geometry_hash(reordered)
+    assert get_geometry_hash(closed) != get_geometry_hash(ring(dx=0.001))
+
+
+def test_first_run_creates(client, manifest_path):
+    result = BoundarySync(client, manifest_path=manifest_path).sync(FARMER_ID, {"b0": ring(), "b1": ring(0.01)})
+
+    assert result.created == ["b0", "b1"]
+    assert [x.id for x in result.boundaries] == ["b0", "b1"]
+    assert boundary_calls(client) == {"boundaries.create_or_update": 2}
+    with open(manifest_path) as f:
+        assert set(json.load(f)[client._config.endpoint][FARMER_ID]) == {"b0", "b1"}
+
+
+def test_rerun_makes_no_calls(client, manifest_path):
+    boundaries = {"b0": ring(), "b1": ring(0.01)}
+    BoundarySync(client, manifest_path=manifest_path).sync(FARMER_ID, boundaries)
+    client.calls.clear()
+
+    result = BoundarySync(client, manifest_path=manifest_path).sync(FARMER_ID, boundaries)
+
+    assert result.unchanged == ["b0", "b1"]
+    assert len(result.boundaries) == 2
+    assert boundary_calls(client) == {}
+
+
+def test_changed_geometry_updates(client, manifest_path):
+    BoundarySync(client, manifest_path=manifest_path).sync(FARMER_ID, {"b0": ring(), "b1": ring(0.01)})
+    client.calls.clear()
+
+    result = BoundarySync(client, manifest_path=manifest_path).sync(FARMER_ID, {"b0": ring(0.002), "b1": ring(0.01)})
+
+    assert result.updated == ["b0"]
+    assert result.unchanged == ["b1"]
+    assert boundary_calls(client) == {
+        "boundaries.begin_create_cascade_delete_job": 1,
+        "boundaries.create_or_update": 1,
+    }
+    assert client.boundaries_store[(FARMER_ID, "b0")].geometry.coordinates[0] == ring(0.002)
+
+
+def test_create_error_does_not_delete(client, manifest_path):
+    client.errors["boundaries.create_or_update"] = [HttpResponseError("Too many requests")]
+
+    result = BoundarySync(client, manifest_path=manifest_path).sync(FARMER_ID, {"b0": ring(), "b1": ring(0.01)})
+
+    assert list(result.failed) == ["b0"]
+    assert result.created == ["b1"]
+    assert [x.id for x in result.boundaries] == ["b1"]
+    assert client.calls["boundaries.begin_create_cascade_delete_job"] == 0
+    # the failed boundary is not in the manifest, so the next sync sends it again
+    result = BoundarySync(client, manifest_path=manifest_path).sync(FARMER_ID, {"b0": ring(), "b1": ring(0.01)})
+    assert result.created == ["b0"]
+    assert result.unchanged == ["b1"]
+
+
+def test_create_error_of_existing_boundary_with_same_geometry_does_not_delete(client, manifest_path):
+    client.add_boundary(FARMER_ID, "b0", ring())
+    client.errors["boundaries.create_or_update"] = [HttpResponseError("Service unavailable")]
+
+    result = BoundarySync(client, manifest_path=manifest_path).sync(FARMER_ID, {"b0": ring()})
+
+    assert result.unchanged == ["b0"]
+    assert client.calls["boundaries.begin_create_cascade_delete_job"] == 0
+
+
+def test_boundary_registered_outside_manifest_with_other_geometry_is_recreated(client, manifest_path):
+    client.add_boundary(FARMER_ID, "b0", ring())
+
+    result = BoundarySync(client, manifest_path=manifest_path).sync(FARMER_ID, {"b0": ring(0.002)})
+
+    assert result.updated == ["b0"]
+    assert client.calls["boundaries.begin_create_cascade_delete_job"] == 1
+    assert client.boundaries_store[(FARMER_ID, "b0")].geometry.coordinates[0] == ring(0.002)
+
+
+def test_verify_recreates_boundary_deleted_outside_manifest(client, manifest_path):
+    BoundarySync(client, manifest_path=manifest_path).sync(FARMER_ID, {"b0": ring()})
+    client.boundaries_store.pop((FARMER_ID, "b0"))
+    client.calls.clear()
+
+    result = BoundarySync(client, manifest_path=manifest_path).sync(FARMER_ID, {"b0": ring()}, verify=True)
+
+    assert result.created == ["b0"]
+    assert boundary_calls(client) == {"boundaries.get": 1, "boundaries.create_or_update": 1}
+
+
+def test_manifest_is_kept_per_endpoint(client, manifest_path):
+    other_client = FakeFarmBeatsClient([], [], [], endpoint="https://other.farmbeats.azure.net")
+    BoundarySync(client, manifest_path=manifest_path).sync(FARMER_ID, {"b0": ring()})
+
+    # same farmer and boundary ids in another FarmBeats instance
+    result = BoundarySync(other_client, manifest_path=manifest_path).sync(FARMER_ID, {"b0": ring()})
+
+    assert result.created == ["b0"]
+    assert (FARMER_ID, "b0") in other_client.boundaries_store
+    with open(manifest_path) as f:
+        assert set(json.load(f)) == {client._config.endpoint, other_client._config.endpoint}
@@ -0,0 +1,46 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+# Third party imports
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+# Local imports
+from utils.cog_util import COGWriter
+
+
+PROFILE = dict(height=40, width=50, transform=from_origin(500000, 5200000, 10, 10), crs="EPSG:32614")
+BAND_NAMES = ["2021-05-11", "2021-05-12"]
+
+
+def forecast(value):
+    return np.full((len(BAND_NAMES), PROFILE["height"], PROFILE["width"]), value, dtype="float32")
+
+
+def test_writes_one_band_per_day(tmp_path):
+    path = str(tmp_path / "forecast.tif")
+
+    with COGWriter(path, PROFILE, BAND_NAMES, blocksize=16) as dst:
+        dst.write_window(forecast(0.5))
+
+    with rasterio.open(path) as src:
+        assert src.count == len(BAND_NAMES)
+        assert list(src.descriptions) == BAND_NAMES
+        assert np.all(src.read() == 0.5)
+    assert [x.name for x in tmp_path.iterdir()] == ["forecast.tif"]
+
+
+def test_error_keeps_existing_output(tmp_path):
+    path = str(tmp_path / "forecast.tif")
+    with COGWriter(path, PROFILE, BAND_NAMES, blocksize=16) as dst:
+        dst.write_window(forecast(0.5))
+
+    with pytest.raises(RuntimeError):
+        with COGWriter(path, PROFILE, BAND_NAMES, blocksize=16) as dst:
+            raise RuntimeError("prediction failed")
+
+    with rasterio.open(path) as src:
+        assert np.all(src.read() == 0.5)
+    assert [x.name for x in tmp_path.iterdir()] == ["forecast.tif"]
@@ -0,0 +1,26 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+# Standard library imports
+import json
+
+# Third party imports
+from rasterio.transform import from_origin
+
+# Local imports
+from utils.geojson_util import GeojsonUtil
+
+
+def square(x0, y0, size):
+    return [[x0, y0], [x0 + size, y0], [x0 + size, y0 + size], [x0, y0 + size], [x0, y0]]
+
+
+def test_polygon_mask_excludes_holes():
+    # 10 x 10 pixels of 1 degree, the hole covers the 2 x 2 pixels in the middle
+    geo_json = json.dumps({"type": "Polygon", "coordinates": [square(0, 0, 10), square(4, 4, 2)]})
+
+    mask = GeojsonUtil.geojson_to_mask(geo_json, from_origin(0, 10, 1, 1), (10, 10))
+
+    assert GeojsonUtil.geojson_to_polygon(geo_json).area == 96
+    assert mask.sum() == 96
+    assert not mask[4:6, 4:6].any()
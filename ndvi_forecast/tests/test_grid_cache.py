@@ -0,0 +1,64 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+# Standard library imports
+from concurrent.futures import ThreadPoolExecutor
+
+# Third party imports
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.transform import from_origin
+
+# Local imports
+from utils.grid_cache import GridCache
+
+
+def write_scene(path, pixel, shape=(4, 5)):
+    """ Writes a scene whose only non-zero value is at pixel (row, col) """
+    data = np.zeros(shape, dtype="float32")
+    data[pixel] = 0.5
+    with rasterio.open(
+        str(path), "w", driver="GTiff", height=shape[0], width=shape[1], count=1, dtype="float32",
+        crs="EPSG:32614", transform=from_origin(500000, 5200000, 10, 10),
+    ) as dst:
+        dst.write(data, 1)
+    return str(path)
+
+
+def sat_links(*paths):
+    return pd.DataFrame({"filePath": list(paths)})
+
+
+def test_mask_follows_current_scenes(tmp_path):
+    first, second, third = [write_scene(tmp_path / "{}.tif".format(i), (i, i)) for i in range(3)]
+    grid_cache = GridCache()
+
+    grid = grid_cache.get("b0", sat_links(first, second))
+    assert list(zip(*np.nonzero(grid.valid_mask))) == [(0, 0), (1, 1)]
+
+    # the first scene aged out of the stack, the third is new
+    assert grid_cache.get("b0", sat_links(second, third)) is grid
+    assert list(zip(*np.nonzero(grid.valid_mask))) == [(1, 1), (2, 2)]
+    assert grid.scene_paths == {second, third}
+
+
+def test_new_scenes_are_read_once(tmp_path):
+    first, second = [write_scene(tmp_path / "{}.tif".format(i), (i, i)) for i in range(2)]
+    grid = GridCache().get("b0", sat_links(first))
+
+    assert grid.update([first, second]) == 1
+    assert grid.update([first, second]) == 0
+    assert grid.valid_mask.sum() == 2
+
+
+def test_update_of_a_grid_does_not_block_other_boundaries(tmp_path):
+    first, second, third = [write_scene(tmp_path / "{}.tif".format(i), (i, i)) for i in range(3)]
+    grid_cache = GridCache()
+    grid = grid_cache.get("b0", sat_links(first))
+
+    # b0 is being updated while b1 is requested
+    with grid.lock, ThreadPoolExecutor(max_workers=1) as executor:
+        other_grid = executor.submit(grid_cache.get, "b1", sat_links(second, third)).result(timeout=10)
+
+    assert other_grid.valid_mask.sum() == 2
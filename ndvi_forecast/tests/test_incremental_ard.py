@@ -0,0 +1,94 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+# Standard library imports
+from datetime import datetime, timedelta
+
+# Third party imports
+import numpy as np
+import pandas as pd
+import pytest
+
+# Local imports
+from benchmarks.synthetic_data import REVISIT_DAYS, SyntheticBoundary, write_sat_file_links
+from utils.ard_util import read_sat_data_array, smooth_and_interpolate
+from utils.incremental_ard import IncrementalARD
+
+
+START = datetime(2020, 6, 10)
+INPUT_DAYS, OUTPUT_DAYS = 30, 10
+# latest input window of appended scenes against a full recompute, at float precision
+TOLERANCE = 1e-6
+
+
+def make_incremental():
+    return IncrementalARD("ndvi", None, None, None, INPUT_DAYS, OUTPUT_DAYS)
+
+
+def full_recompute(sat_links):
+    scene_dates = pd.to_datetime(sat_links.sceneDateTime.str[:10])
+    return smooth_and_interpolate(read_sat_data_array(sat_links, 1, "ndvi"), scene_dates.min(), scene_dates.max())
+
+
+def assert_matches_full_recompute(incremental, sat_links):
+    full = full_recompute(sat_links)
+    window = full.index[-INPUT_DAYS:]
+    interpolated = incremental.get_interpolated("b0")
+    assert list(interpolated.columns) == list(full.columns)
+    assert np.nanmax(np.abs(interpolated.loc[window].values - full.loc[window].values)) < TOLERANCE
+
+
+@pytest.mark.parametrize("scene_count", [12, 24])
+def test_append_one_scene_at_a_time_matches_full_recompute(tmp_path, scene_count):
+    boundary = SyntheticBoundary("b0", -97.0652, 46.6627, 0.2)
+    sat_links = write_sat_file_links(boundary, str(tmp_path), START, scene_count)
+    incremental = make_incremental()
+    incremental.append_scenes("b0", sat_links.iloc[:6])
+    for i in range(7, scene_count + 1):
+        incremental.append_scenes("b0", sat_links.iloc[:i])
+        assert_matches_full_recompute(incremental, sat_links.iloc[:i])
+
+
+def test_scenes_leaving_the_stack_are_dropped(tmp_path):
+    boundary = SyntheticBoundary("b0", -97.0652, 46.6627, 0.2)
+    sat_links = write_sat_file_links(boundary, str(tmp_path), START, 20)
+    incremental = make_incremental()
+    incremental.append_scenes("b0", sat_links.iloc[:12])
+    # a 12 scene window moving by one scene per request, as the 60 day window of the scoring service
+    for i in range(13, 21):
+        assert incremental.append_scenes("b0", sat_links.iloc[i - 12:i]) == 1
+        assert_matches_full_recompute(incremental, sat_links.iloc[i - 12:i])
+        assert set(incremental._states["b0"].scene_dates) == set(sat_links.iloc[i - 12:i].filePath.astype(str))
+    # only scenes dropped
+    assert incremental.append_scenes("b0", sat_links.iloc[10:20]) == 0
+    assert_matches_full_recompute(incremental, sat_links.iloc[10:20])
+
+
+def test_new_grid_resets_state(tmp_path):
+    small = SyntheticBoundary("b0", -97.0652, 46.6627, 0.2)
+    large = SyntheticBoundary("b0", -97.0652, 46.6627, 0.3)
+    small_links = write_sat_file_links(small, str(tmp_path / "small"), START, 8)
+    large_links = write_sat_file_links(large, str(tmp_path / "large"), START + timedelta(days=40), 4)
+    incremental = make_incremental()
+    incremental.append_scenes("b0", small_links)
+
+    assert incremental.append_scenes("b0", large_links) == 4
+    interpolated = incremental.get_interpolated("b0")
+    assert interpolated.index[0] == START + timedelta(days=40)
+    assert list(interpolated.columns) == list(full_recompute_columns(large_links))
+
+
+def test_new_geometry_resets_state(tmp_path):
+    boundary = SyntheticBoundary("b0", -97.0652, 46.6627, 0.2)
+    sat_links = write_sat_file_links(boundary, str(tmp_path), START, 8)
+    incremental = make_incremental()
+    incremental.append_scenes("b0", sat_links)
+
+    # same scenes, recreated boundary with another geometry
+    geometry = boundary.multipolygon_geojson()
+    assert incremental.append_scenes("b0", sat_links, boundary_geometry=geometry) == 8
+    assert incremental.append_scenes("b0", sat_links, boundary_geometry=geometry) == 0
+
+
+def full_recompute_columns(sat_links):
+    return read_sat_data_array(sat_links, 1, "ndvi").columns
@@ -0,0 +1,42 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+# Third party imports
+import pytest
+
+# Local imports
+from utils.io_utils import IOUtil
+
+
+def write_text(text):
+    def write(file_path):
+        with open(file_path, "w") as f:
+            f.write(text)
+    return write
+
+
+def test_write_file_atomically_replaces_file(tmp_path):
+    file_path = str(tmp_path / "out" / "data.json")
+
+    IOUtil.write_file_atomically(file_path, write_text("first"))
+    IOUtil.write_file_atomically(file_path, write_text("second"))
+
+    with open(file_path) as f:
+        assert f.read() == "second"
+    assert sorted(x.name for x in (tmp_path / "out").iterdir()) == ["data.json"]
+
+
+def test_write_file_atomically_keeps_file_on_error(tmp_path):
+    file_path = str(tmp_path / "data.json")
+    IOUtil.write_file_atomically(file_path, write_text("first"))
+
+    def fail(tmp_file_path):
+        write_text("partial")(tmp_file_path)
+        raise RuntimeError("write failed")
+
+    with pytest.raises(RuntimeError):
+        IOUtil.write_file_atomically(file_path, fail)
+
+    with open(file_path) as f:
+        assert f.read() == "first"
+    assert [x.name for x in tmp_path.iterdir()] == ["data.json"]
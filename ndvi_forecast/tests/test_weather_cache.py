@@ -0,0 +1,146 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+# Standard library imports
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Third party imports
+import pandas as pd
+import pytest
+
+# Local imports
+from benchmarks.synthetic_data import FakeFarmBeatsClient
+from utils.weather_cache import WeatherCache
+
+
+FARMER_ID = "test_farmer"
+LON, LAT, SIZE = -97.0652, 46.6627, 0.0005
+START, END = datetime(2020, 6, 1), datetime(2020, 6, 30)
+ENDPOINT = "https://test.farmbeats.azure.net"
+
+
+def ring(dx=0.0):
+    lon, lat = LON + dx, LAT
+    return [[lon, lat], [lon + SIZE, lat], [lon + SIZE, lat + SIZE], [lon, lat + SIZE], [lon, lat]]
+
+
+@pytest.fixture
+def client():
+    client = FakeFarmBeatsClient(
+        ["airTempMin-F", "precipitation-in"], [[30.0, 0.1]], [[10.0, 0.2]], latency=0.05, endpoint=ENDPOINT
+    )
+    # a and b share a 0.05 degree cell, c is in the next one
+    for boundary_id, dx in [("a", 0.0), ("b", 0.001), ("c", 0.05)]:
+        client.add_boundary(FARMER_ID, boundary_id, ring(dx))
+    return client
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / "weather_cache")
+
+
+def make_cache(cache_dir, endpoint=ENDPOINT):
+    return WeatherCache(cache_dir=cache_dir, cell_size_deg=0.05, extension_id="test", endpoint=endpoint)
+
+
+def test_boundaries_of_a_cell_share_one_fetch(client, cache_dir):
+    weather_cache = make_cache(cache_dir)
+    representatives = weather_cache.register_boundaries(FARMER_ID, {x: ring(dx) for x, dx in [("a", 0), ("b", 0.001)]})
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        frames = list(executor.map(
+            lambda x: weather_cache.get_weather_df(client, FARMER_ID, x, "historical", START, END), ["a", "b"] * 8
+        ))
+
+    assert [x.id for x in representatives] == ["a"]
+    assert client.calls["weather.list"] == 1
+    assert weather_cache._fetch_locks == {}
+    pd.testing.assert_frame_equal(frames[0], frames[-1])
+
+
+def test_index_changes_of_other_instances_are_kept(client, cache_dir):
+    first, second = make_cache(cache_dir), make_cache(cache_dir)
+    first.register(FARMER_ID, "a", ring())
+    second.register(FARMER_ID, "c", ring(0.05))
+    first.mark_ingested(first.get_cell_of(FARMER_ID, "a"), "historical", START, END)
+
+    reloaded = make_cache(cache_dir)
+    assert reloaded.get_cell_of(FARMER_ID, "a") != reloaded.get_cell_of(FARMER_ID, "c")
+    assert not reloaded.needs_ingestion(reloaded.get_cell_of(FARMER_ID, "a"), "historical", START, END)
+    # registered by another instance after this one loaded the index
+    assert second.get_cell_of(FARMER_ID, "a") == first.get_cell_of(FARMER_ID, "a")
+
+
+def test_weather_without_dates_is_not_written_to_disk(client, cache_dir):
+    weather_cache = make_cache(cache_dir)
+    weather_cache.register(FARMER_ID, "a", ring())
+    forecast_end = START + timedelta(days=10)
+
+    weather_cache.get_weather_df(client, FARMER_ID, "a", "forecast")
+    weather_cache.get_weather_df(client, FARMER_ID, "a", "forecast", START, forecast_end)
+
+    assert sorted(x for x in os.listdir(weather_cache.cache_dir) if x.endswith(".csv")) == [
+        weather_cache._get_key(weather_cache.get_cell_of(FARMER_ID, "a"), "forecast", START, forecast_end) + ".csv"
+    ]
+    assert not make_cache(cache_dir).has_weather(FARMER_ID, "a", "forecast")
+
+
+def test_moved_representative_hands_over_its_cell(client, cache_dir):
+    weather_cache = make_cache(cache_dir)
+    weather_cache.register_boundaries(FARMER_ID, {"a": ring(), "b": ring(0.001)})
+    old_cell = weather_cache.get_cell_of(FARMER_ID, "a")
+    weather_cache.mark_ingested(old_cell, "historical", START, END)
+
+    # a moves about 40 km
+    new_cell = weather_cache.register(FARMER_ID, "a", ring(0.5))
+
+    assert new_cell != old_cell
+    assert weather_cache.get_representative(old_cell).id == "b"
+    assert weather_cache.get_representative(new_cell).id == "a"
+    # the weather of the old cell was ingested for a, so it is ingested again for b
+    assert weather_cache.needs_ingestion(old_cell, "historical", START, END)
+    assert make_cache(cache_dir).get_representative(old_cell).id == "b"
+
+
+def test_forget_drops_representative_and_ingested_weather(client, cache_dir):
+    weather_cache = make_cache(cache_dir)
+    cell = weather_cache.register(FARMER_ID, "a", ring())
+    weather_cache.mark_ingested(cell, "historical", START, END)
+
+    # e.g. recreated by BoundarySync, whose cascade delete removed its weather
+    weather_cache.forget(FARMER_ID, ["a"])
+
+    assert cell not in weather_cache.index["representatives"]
+    assert weather_cache.register(FARMER_ID, "a", ring()) == cell
+    assert weather_cache.needs_ingestion(cell, "historical", START, END)
+
+
+def test_invalidate_drops_cached_weather(client, cache_dir):
+    weather_cache = make_cache(cache_dir)
+    cell = weather_cache.register(FARMER_ID, "a", ring())
+    weather_cache.mark_ingested(cell, "historical", START, END)
+    weather_cache.get_weather_df(client, FARMER_ID, "a", "historical", START, END)
+
+    weather_cache.invalidate(cell)
+
+    assert not weather_cache.has_weather(FARMER_ID, "a", "historical", START, END)
+    assert weather_cache.needs_ingestion(cell, "historical", START, END)
+
+
+def test_endpoints_do_not_share_cells_or_weather(client, cache_dir):
+    weather_cache = make_cache(cache_dir)
+    other_cache = make_cache(cache_dir, endpoint="https://other.farmbeats.azure.net")
+    cell = weather_cache.register(FARMER_ID, "a", ring())
+    weather_cache.mark_ingested(cell, "historical", START, END)
+    weather_cache.get_weather_df(client, FARMER_ID, "a", "historical", START, END)
+
+    assert other_cache.cache_dir != weather_cache.cache_dir
+    assert not other_cache.has_weather(FARMER_ID, "a", "historical", START, END)
+    other_cache.register(FARMER_ID, "b", ring(0.001))
+    assert other_cache.get_representative(cell).id == "b"
+    assert other_cache.needs_ingestion(cell, "historical", START, END)
+    with pytest.raises(ValueError):
+        other_cache.get_weather_df(client, FARMER_ID, "b", "historical", START, END)
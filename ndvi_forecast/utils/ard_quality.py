@@ -0,0 +1,122 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+# Standard library imports
+from collections import OrderedDict
+
+# Third party imports
+import numpy as np
+import pandas as pd
+
+
+# Quality issues of an ARD row (input and forecast window of a pixel), bit i is 2**i
+QUALITY_FLAGS = OrderedDict(
+    [
+        ("input_evi_nan", 1),
+        ("input_weather_nan", 2),
+        ("output_evi_nan", 4),
+        ("forecast_weather_nan", 8),
+        ("input_evi_gt1", 16),
+        ("output_evi_gt1", 32),
+    ]
+)
+
+# Boolean ARD columns (True when the row is fine) and their quality flag
+FLAG_COLUMNS = OrderedDict(
+    [
+        ("input_evi_le1", "input_evi_gt1"),
+        ("output_evi_le1", "output_evi_gt1"),
+        ("nan_input_evi", "input_evi_nan"),
+        ("nan_input_w", "input_weather_nan"),
+        ("nan_output_evi", "output_evi_nan"),
+        ("nan_output_w", "forecast_weather_nan"),
+    ]
+)
+
+# Missing values in the data the model needs for scoring
+SCORING_NAN = (
+    QUALITY_FLAGS["input_evi_nan"] | QUALITY_FLAGS["input_weather_nan"] | QUALITY_FLAGS["forecast_weather_nan"]
+)
+
+
+def get_quality_bitmask(input_evi, input_weather, output_evi, forecast_weather, window_index=None) -> np.ndarray:
+    """
+    Computes the quality bitmask of ARD rows with one reduction per tensor.
+    :param input_evi: (rows, input_days, 1) array
+    :param input_weather: (rows, input_days, weather parameters) array
+    :param output_evi: (rows, output_days, 1) array
+    :param forecast_weather: (rows, output_days, weather parameters) array
+    :param window_index: if given, weather arrays are per window and this is the window of each row
+    :return: uint8 array of QUALITY_FLAGS bits per row, 0 for rows without issues
+    """
+    bitmask = np.zeros(input_evi.shape[0], dtype=np.uint8)
+    for flag, tensor in [("input_evi_nan", input_evi), ("output_evi_nan", output_evi)]:
+        bitmask[np.isnan(tensor).any(axis=(1, 2))] |= QUALITY_FLAGS[flag]
+    for flag, tensor in [("input_weather_nan", input_weather), ("forecast_weather_nan", forecast_weather)]:
+        has_nan = np.isnan(tensor).any(axis=(1, 2))
+        bitmask[has_nan if window_index is None else has_nan[window_index]] |= QUALITY_FLAGS[flag]
+    # rows with only missing values are out of range too, as with np.nanmax(...) <= 1
+    with np.errstate(invalid="ignore"):
+        for flag, tensor in [("input_evi_gt1", input_evi), ("output_evi_gt1", output_evi)]:
+            out_of_range = np.isnan(tensor).all(axis=(1, 2)) | (np.abs(tensor) > 1).any(axis=(1, 2))
+            bitmask[out_of_range] |= QUALITY_FLAGS[flag]
+    return bitmask
+
+
+class QualityReport:
+    """
+    Quality of an ARD DataFrame, computed once from its quality bitmask column:
+    counts per flag, windows per pixel and per pixel bitmask.
+    Consumed by training filtering and scoring warnings.
+    """
+
+    def __init__(self, ard):
+        """
+        :param ard: ARD DataFrame or CompactARD as returned by ard_preprocess
+        """
+        if isinstance(ard, pd.DataFrame):
+            self.bitmask = ard["quality"].values.astype(np.uint8)
+            self.lat = ard["lat_"].values
+            self.long = ard["long_"].values
+            self.grp1 = ard["grp1_"].values
+        else:
+            self.bitmask = ard.quality
+            self.lat, self.long = ard.get_coords()
+            self.grp1 = ard.grp1
+        self.rows = self.bitmask.shape[0]
+        flag_counts = np.unpackbits(self.bitmask[:, None], axis=1, bitorder="little").sum(axis=0)
+        self.counts = OrderedDict((flag, int(x)) for flag, x in zip(QUALITY_FLAGS, flag_counts))
+        self.valid = self.bitmask == 0
+        self.valid_rows = int(self.valid.sum())
+        # rows of a later window than the first one
+        self.multi_window_rows = int((self.grp1 > 0).sum())
+        # input out of range, without missing values
+        self.range_rows = int(
+            ((self.bitmask & (SCORING_NAN | QUALITY_FLAGS["input_evi_gt1"])) == QUALITY_FLAGS["input_evi_gt1"]).sum()
+        )
+
+    def get_warnings(self) -> list:
+        """ Returns scoring warnings for missing input data or input data out of range """
+        warnings = []
+        if (self.bitmask & SCORING_NAN).any():
+            warnings.append("Warning: NaNs found in the input data")
+        if self.range_rows > 0:
+            warnings.append("Warning: input data outside range of (-1,1) found")
+        return warnings
+
+    def get_pixel_bitmask(self) -> pd.DataFrame:
+        """ Returns the bitwise or of the quality bitmask over the windows of each pixel """
+        return (
+            pd.DataFrame({"lat": self.lat, "long": self.long, "quality": self.bitmask})
+            .groupby(["lat", "long"], sort=False)["quality"]
+            .agg(np.bitwise_or.reduce)
+            .reset_index()
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "rows": self.rows,
+            "valid_rows": self.valid_rows,
+            "multi_window_rows": self.multi_window_rows,
+            "counts": dict(self.counts),
+        }
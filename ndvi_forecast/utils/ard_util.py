@@ -4,6 +4,8 @@
 # Standard imports
 import json
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 # Third party imports
@@ -13,6 +15,30 @@ import rasterio
 import xarray as xr
 from statsmodels.nonparametric.smoothers_lowess import lowess
 
+# Local imports
+from utils.ard_quality import FLAG_COLUMNS, QUALITY_FLAGS, get_quality_bitmask
+from utils.compact_ard import CompactARD, build_compact_ard, build_sliding_window_ard
+from utils.geojson_util import GeojsonUtil
+from utils.tile_util import TileUtil
+
+
+ARD_COLUMNS = [
+    "lat_",
+    "long_",
+    "grp1_",
+    "input_evi",
+    "input_weather",
+    "forecast_weather",
+    "output_evi",
+    "input_evi_le1",
+    "output_evi_le1",
+    "nan_input_evi",
+    "nan_input_w",
+    "nan_output_evi",
+    "nan_output_w",
+    "quality",
+]
+
 
 def ard_preprocess(
     sat_file_links,
@@ -27,56 +53,116 @@ def ard_preprocess(
     ref_tm,
     w_mn,
     w_sd,
+    window=None,
+    boundary_geometry=None,
+    grid=None,
+    compact=False,
+    weather_dtype="float32",
+    stride=None,
 ):
 
     """
     This method takes boundary satellite paths and weather data, creates Analysis Ready DataSet (ARD) 
+    If a rasterio window is given, only that part of the rasters is read and processed.
+    If a boundary geometry (geojson string of Polygon/MultiPolygon) is given, pixels outside of it are dropped.
+    If a BoundaryGrid (from GridCache) is given, its cached coordinates and always zero mask are used.
+    With compact, a CompactARD of float32 arrays (weather_dtype for weather) is returned instead of a DataFrame.
+    With stride, a SlidingWindowARD of (overlapping) windows starting every stride days is returned.
     # TODO: Add doc string or re-arrange parameters
     """
-    sat_file_links["sat_data"] = [
-        rasterio.open(x).read(1) for x in sat_file_links.filePath.values
-    ]
-    getgeo1 = rasterio.open(
-        sat_file_links.filePath.values[0]
-    ).transform  # coordinates of farm    
-    
-    sat_data = np.array(sat_file_links.sat_data.values.tolist())
-    
-    msk = np.broadcast_to(
-        np.mean(sat_data == 0, axis=0) < 1, sat_data.shape
-    )  # mask for removing pixels with 0 value always
-    sat_data1 = np.where(msk, sat_data, np.nan)[
-        :, ::sat_res_x, ::sat_res_x
-    ]  # spatial sampling
-    
-    idx = pd.date_range(interp_date_start, interp_date_end)  # interpolation range
-    idx_time = pd.date_range(
-        w_df.dateTime.sort_values().values[0][:10],
-        w_df.dateTime.sort_values(ascending=False).values[0][:10],
+    data_array = read_sat_data_array(
+        sat_file_links, sat_res_x, var_name, window=window, boundary_geometry=boundary_geometry, grid=grid
     )
+    if compact or stride:
+        if grid is not None:
+            transform = grid.transform
+        else:
+            with rasterio.open(sat_file_links.filePath.values[0]) as src:
+                transform = src.transform
+    if data_array is None:  # no valid pixels, e.g. a tile outside of the field
+        if stride:
+            data_array = pd.DataFrame(columns=pd.MultiIndex.from_tuples([], names=[None, "lat", "long"]))
+            return build_sliding_window_ard(
+                data_array, w_df, w_parms, input_days, output_days, ref_tm, w_mn, w_sd, transform, stride
+            )
+        if compact:
+            return CompactARD.empty(input_days, output_days, len(w_parms), transform, weather_dtype)
+        return pd.DataFrame(columns=ARD_COLUMNS)
+
+    data_inter = smooth_and_interpolate(data_array, interp_date_start, interp_date_end)
+    if stride:
+        return build_sliding_window_ard(
+            data_inter, w_df, w_parms, input_days, output_days, ref_tm, w_mn, w_sd, transform, stride
+        )
+    if compact:
+        return build_compact_ard(
+            data_inter, w_df, w_parms, input_days, output_days, ref_tm, w_mn, w_sd, transform, weather_dtype
+        )
+
+    return build_ard(
+        data_inter, w_df, var_name, w_parms, input_days, output_days, ref_tm, w_mn, w_sd
+    )
+
+
+def read_sat_data_array(sat_file_links, sat_res_x, var_name, window=None, boundary_geometry=None, grid=None):
+    """
+    Reads (sampled) boundary scenes into a DataFrame with scene dates as index and
+    one column per valid pixel, (var_name, lat, long). Returns None if there are no valid pixels.
+    """
+    sat_data = []
+    for file_path in sat_file_links.filePath.values:
+        with rasterio.open(file_path) as src:
+            sat_data.append(src.read(1, window=window)[::sat_res_x, ::sat_res_x])  # spatial sampling
+    sat_data = np.array(sat_data)
+
+    if grid is None:
+        with rasterio.open(sat_file_links.filePath.values[0]) as src:
+            # coordinates of farm (or of the window)
+            getgeo1 = src.transform if window is None else src.window_transform(window)
+            transform, shape, crs = src.transform, src.shape, src.crs
+        lat = getgeo1[5] + getgeo1[4] * sat_res_x * np.arange(sat_data.shape[1])
+        long = getgeo1[2] + getgeo1[0] * sat_res_x * np.arange(sat_data.shape[2])
+        # mask for removing pixels with 0 value always
+        msk = np.mean(sat_data == 0, axis=0) < 1
+    else:
+        # coordinates and always zero mask are cached per boundary grid
+        lat, long = grid.get_coords(sat_res_x, window)
+        msk = grid.get_valid_mask(sat_res_x, window)
+        transform, shape, crs = grid.transform, grid.shape, grid.crs
+    if boundary_geometry is not None:
+        # mask for removing pixels outside of the boundary, cached per boundary and grid
+        geom_msk = GeojsonUtil.geojson_to_mask(boundary_geometry, transform, shape, crs)
+        if window is not None:
+            geom_msk = geom_msk[window.toslices()]
+        msk = msk & geom_msk[::sat_res_x, ::sat_res_x]
+
+    if not msk.any():
+        return None
+    sat_data1 = np.where(msk, sat_data, np.nan)
+
     # read satellite data into data array
     data_array = (
         xr.DataArray(
             sat_data1,
             [
                 ("time", pd.to_datetime(sat_file_links.sceneDateTime).dt.date),
-                (
-                    "lat",
-                    getgeo1[5] + getgeo1[4] * sat_res_x * np.arange(sat_data1.shape[1]),
-                ),
-                (
-                    "long",
-                    getgeo1[2] + getgeo1[0] * sat_res_x * np.arange(sat_data1.shape[2]),
-                ),
+                ("lat", lat),
+                ("long", long),
             ],
         )
         .to_dataframe(var_name)
         .dropna()
         .unstack(level=[1, 2])
+        .dropna(axis=1, how="all")  # unstack adds every lat/long combination, keep valid pixels only
     )
-    
-    # lowess smoothing to remove outliers and cubic spline interpolation
-    data_array = data_array.sort_index(ascending=True)   ## Sort before calculating xvals
+    return data_array.sort_index(ascending=True)   ## Sort before calculating xvals
+
+
+def smooth_and_interpolate(data_array, interp_date_start, interp_date_end):
+    """
+    lowess smoothing of each pixel's series to remove outliers and
+    cubic spline interpolation to daily values between interp_date_start and interp_date_end
+    """
     xvals = (pd.Series(data_array.index) - data_array.index.values[0]).dt.days
     data_inter = pd.DataFrame(
         {
@@ -85,19 +171,34 @@ def ard_preprocess(
         }
     )
     data_inter.index = data_array.index
-    data_comb_array = (
+    idx = pd.date_range(interp_date_start, interp_date_end)  # interpolation range
+    return (
         data_inter.reindex(idx, fill_value=np.nan)
         .interpolate(method="cubic", limit_direction="both", limit=100)
-        .reindex(idx_time, fill_value=np.nan)
     )
 
+
+def build_ard(data_inter, w_df, var_name, w_parms, input_days, output_days, ref_tm, w_mn, w_sd):
+    """
+    Combines daily interpolated satellite data with normalized weather data and
+    cuts them into input and forecast windows of input_days + output_days from ref_tm
+    """
+    idx_time = pd.date_range(
+        w_df.dateTime.sort_values().values[0][:10],
+        w_df.dateTime.sort_values(ascending=False).values[0][:10],
+    )
+    data_comb_array = data_inter.reindex(idx_time, fill_value=np.nan)
+
     # Read Weather Data and normalization
+    w_df = w_df.copy()
     w_df[w_parms] = (w_df[w_parms] - w_mn) / (np.maximum(w_sd, 0.001))
     w_df["time"] = pd.to_datetime(w_df.dateTime).dt.date
     
     # combine interpolated satellite data array with weather data
+    data_comb_df = data_comb_array.stack([1, 2], dropna=False)
+    # stack adds every lat/long combination, keep valid pixels only
     data_comb_df = (
-        data_comb_array.stack([1, 2], dropna=False)
+        data_comb_df[data_comb_df.index.droplevel(0).isin(data_comb_array.columns.droplevel(0))]
         .rename_axis(["time", "lat", "long"])
         .reset_index()
     )
@@ -141,10 +242,12 @@ def ard_preprocess(
         "len_input == " + str(input_days) + " and len_output == " + str(output_days)
     )
     # separating out NDVI/EVI from weather parameters
-    da2["input_evi"] = np.array(da2.lst1_input.tolist())[:, :, 0:1].tolist()
-    da2["input_weather"] = np.array(da2.lst1_input.tolist())[:, :, 1:].tolist()
-    da2["forecast_weather"] = np.array(da2.lst1_output.tolist())[:, :, 1:].tolist()
-    da2["output_evi"] = np.array(da2.lst1_output.tolist())[:, :, 0:1].tolist()
+    lst1_input = np.array(da2.lst1_input.tolist(), dtype=float).reshape(da2.shape[0], input_days, len(w_parms) + 1)
+    lst1_output = np.array(da2.lst1_output.tolist(), dtype=float).reshape(da2.shape[0], output_days, len(w_parms) + 1)
+    da2["input_evi"] = lst1_input[:, :, 0:1].tolist()
+    da2["input_weather"] = lst1_input[:, :, 1:].tolist()
+    da2["forecast_weather"] = lst1_output[:, :, 1:].tolist()
+    da2["output_evi"] = lst1_output[:, :, 0:1].tolist()
     da3 = da2[
         [
             "lat_",
@@ -156,28 +259,53 @@ def ard_preprocess(
             "output_evi",
         ]
     ]
-    # checking for NDVI between - 1 and 1 in both input and output
-    da3["input_evi_le1"] = (
-        np.nanmax(np.abs(np.array(da3.input_evi.to_list())), axis=(1, 2)) <= 1
+    # checking for missing values and NDVI between - 1 and 1 in both input and output
+    quality = get_quality_bitmask(
+        lst1_input[:, :, 0:1], lst1_input[:, :, 1:], lst1_output[:, :, 0:1], lst1_output[:, :, 1:]
     )
-    da3["output_evi_le1"] = (
-        np.nanmax(np.abs(np.array(da3.output_evi.to_list())), axis=(1, 2)) <= 1
-    )
-    # checking for missing values
-    da3["nan_input_evi"] = [
-        np.sum(np.isnan(np.array(x))) == 0 for x in da3.input_evi.values
-    ]
-    da3["nan_input_w"] = [
-        np.sum(np.isnan(np.array(x))) == 0 for x in da3.input_weather.values
-    ]
-    da3["nan_output_evi"] = [
-        np.sum(np.isnan(np.array(x))) == 0 for x in da3.output_evi.values
-    ]
-    da3["nan_output_w"] = [
-        np.sum(np.isnan(np.array(x))) == 0 for x in da3.forecast_weather.values
-    ]
+    for column, flag in FLAG_COLUMNS.items():
+        da3[column] = (quality & QUALITY_FLAGS[flag]) == 0
+    da3["quality"] = quality
 
     # Re-index based on lat and long
     da3.sort_values(by=['lat_','long_'], ascending=[False, True], inplace=True)
     
-    return da3
\ No newline at end of file
+    return da3
+
+
+def ard_preprocess_tiled(sat_file_links, sat_res_x, tile_size, max_workers=1, **kwargs):
+    """
+    Tiled version of ard_preprocess for large boundaries. The raster extent is split into
+    tile_size x tile_size pixel windows, which are read, smoothed and windowed independently,
+    so peak memory is bounded by the tile size (times max_workers) instead of the field size.
+    :param tile_size: tile width and height in pixels, rounded up to a multiple of sat_res_x
+    :param max_workers: number of tiles processed in parallel
+    :param kwargs: remaining ard_preprocess arguments
+    :return: generator of (rasterio window, ARD DataFrame of the tile)
+    """
+    if kwargs.get("grid") is not None:
+        height, width = kwargs["grid"].shape
+    else:
+        with rasterio.open(sat_file_links.filePath.values[0]) as src:
+            height, width = src.shape
+    windows = TileUtil.get_tile_windows(height, width, tile_size, sat_res_x)
+
+    def process(window):
+        return ard_preprocess(sat_file_links=sat_file_links, sat_res_x=sat_res_x, window=window, **kwargs)
+
+    if max_workers <= 1:
+        for window in windows:
+            yield window, process(window)
+        return
+
+    # keep at most max_workers tiles in flight, so finished tiles don't pile up in memory
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for window in windows:
+            pending.append((window, executor.submit(process, window)))
+            if len(pending) >= max_workers:
+                done_window, future = pending.popleft()
+                yield done_window, future.result()
+        while pending:
+            done_window, future = pending.popleft()
+            yield done_window, future.result()
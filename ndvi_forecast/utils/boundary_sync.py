@@ -0,0 +1,260 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+# Standard library imports
+import hashlib
+import json
+import os
+import uuid
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+# Third party imports
+import pandas as pd
+
+# Local imports
+from utils.constants import CONSTANTS
+from utils.io_utils import IOUtil
+
+# Library specific imports
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+from azure.agrifood.farming.models import Boundary, Polygon
+
+
+# Farmer and boundary id of a registered boundary, usable where the FarmBeats
+# Boundary object is only read for these two attributes (e.g. SatelliteUtil)
+BoundaryRef = namedtuple("BoundaryRef", ["farmer_id", "id"])
+
+# Decimal places kept when hashing geometries, ~1 cm in degrees
+HASH_DECIMALS = 7
+
+
+def normalize_ring(ring: list, decimals: int = HASH_DECIMALS) -> list:
+    """
+    Normalizes a polygon ring so equal shapes compare equal: rounded coordinates,
+    no repeated vertices, counterclockwise, starting at the smallest vertex and closed.
+    :param ring: list of [longitude, latitude]
+    """
+    points = []
+    for lon, lat in ring:
+        point = (round(float(lon), decimals), round(float(lat), decimals))
+        if not points or point != points[-1]:
+            points.append(point)
+    if len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    # shoelace formula, negative for a clockwise ring
+    area2 = sum(
+        x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1])
+    )
+    if area2 < 0:
+        points.reverse()
+    if points:
+        start = points.index(min(points))
+        points = points[start:] + points[:start] + [points[start]]
+    return [list(x) for x in points]
+
+
+def get_geometry_hash(ring: list) -> str:
+    """ Returns the sha1 hex digest of the normalized polygon ring """
+    return hashlib.sha1(json.dumps(normalize_ring(ring), separators=(",", ":")).encode()).hexdigest()
+
+
+def get_client_endpoint(fb_client) -> str:
+    """ Returns the endpoint of the FarmBeats instance of a client, empty if it is not known """
+    # FarmBeatsClient keeps the endpoint in its configuration only
+    return getattr(getattr(fb_client, "_config", None), "endpoint", None) or ""
+
+
+class BoundarySyncResult:
+    """
+    Outcome of a BoundarySync.sync call: boundary ids per action, failures with their
+    error and references to all boundaries registered with the requested geometry.
+    """
+
+    def __init__(self, farmer_id):
+        self.farmer_id = farmer_id
+        self.created = []
+        self.updated = []
+        self.unchanged = []
+        self.failed = OrderedDict()
+        self.boundaries = []
+
+    def to_dict(self) -> dict:
+        return {
+            "created": len(self.created),
+            "updated": len(self.updated),
+            "unchanged": len(self.unchanged),
+            "failed": len(self.failed),
+        }
+
+    def __repr__(self):
+        return "BoundarySyncResult({})".format(self.to_dict())
+
+
+class BoundarySync:
+    """
+    Registers many boundaries of a farmer in FarmBeats. Geometry hashes of registered
+    boundaries are kept in a local JSON manifest, per FarmBeats endpoint, so only new or
+    changed boundaries are sent, concurrently, and re-running with the same boundaries
+    makes no API calls.
+    A boundary whose geometry changed is deleted (cascade delete job) and created again.
+
+    sync = BoundarySync(fb_client)
+    result = sync.sync(farmer_id, BoundarySync.read_boundaries_csv("data/farms_sample_1kmx1km.csv"))
+    """
+
+    def __init__(self, fb_client, manifest_path=None, max_workers=16, description="Created by SDK"):
+        """
+        :param fb_client: FarmBeats client
+        :param manifest_path: JSON file of {endpoint: {farmer_id: {boundary_id: geometry hash}}},
+            defaults to boundary_manifest.json in the root dir
+        :param max_workers: concurrent create and delete calls
+        """
+        self.fb_client = fb_client
+        self.manifest_path = manifest_path or os.path.join(CONSTANTS["root_dir"], "boundary_manifest.json")
+        self.max_workers = max_workers
+        self.description = description
+        self.endpoint = get_client_endpoint(fb_client)
+        self._lock = Lock()
+        # boundaries registered in this client's FarmBeats instance, {farmer_id: {boundary_id: geometry hash}}
+        self.manifest = self._load_manifest().get(self.endpoint, {})
+
+
+    @staticmethod
+    def read_boundaries_csv(path: str, geometry_column="farms", id_prefix="boundary", nrows=None) -> OrderedDict:
+        """
+        Reads boundary rings stored as JSON strings in a csv column, parsing them with
+        a single json.loads call. Boundary ids are id_prefix + row number.
+        :param nrows: number of rows to read, all if not given
+        :return: OrderedDict of boundary id to ring
+        """
+        geometries = pd.read_csv(path, usecols=[geometry_column], nrows=nrows)[geometry_column]
+        rings = json.loads("[" + ",".join(geometries) + "]")
+        return OrderedDict((id_prefix + str(i), ring) for i, ring in enumerate(rings))
+
+
+    def sync(self, farmer_id: str, boundaries, verify=False) -> BoundarySyncResult:
+        """
+        Creates new boundaries and recreates boundaries with a changed geometry.
+        :param boundaries: dict (or iterable of pairs) of boundary id to polygon ring
+        :param verify: also check with boundaries.get that unchanged boundaries still exist
+            with the same geometry, e.g. when they may have been deleted outside this manifest
+        :return: BoundarySyncResult
+        """
+        boundaries = OrderedDict(boundaries)
+        hashes = OrderedDict((k, get_geometry_hash(v)) for k, v in boundaries.items())
+        registered = self.manifest.get(farmer_id, {})
+        result = BoundarySyncResult(farmer_id)
+
+        pending = []
+        for boundary_id, geometry_hash in hashes.items():
+            if boundary_id not in registered:
+                pending.append((boundary_id, "created"))
+            elif registered[boundary_id] != geometry_hash:
+                pending.append((boundary_id, "updated"))
+            elif verify:
+                pending.append((boundary_id, "unchanged"))
+            else:
+                result.unchanged.append(boundary_id)
+
+        def sync_one(boundary_id, action):
+            ring = boundaries[boundary_id]
+            if action == "unchanged":
+                remote_hash = self._get_remote_hash(farmer_id, boundary_id)
+                if remote_hash == hashes[boundary_id]:
+                    return action
+                action = "created" if remote_hash is None else "updated"
+            if action == "updated":
+                self._delete(farmer_id, boundary_id)
+                self._create(farmer_id, boundary_id, ring)
+                return action
+            try:
+                self._create(farmer_id, boundary_id, ring)
+            except HttpResponseError:
+                # only a boundary registered outside the manifest with another geometry is recreated,
+                # other errors (e.g. throttling) fail the boundary without deleting its data
+                remote_hash = self._get_remote_hash(farmer_id, boundary_id)
+                if remote_hash is None:
+                    raise
+                if remote_hash == hashes[boundary_id]:
+                    return "unchanged"
+                self._delete(farmer_id, boundary_id)
+                self._create(farmer_id, boundary_id, ring)
+                return "updated"
+            return action
+
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(pending))) as executor:
+                futures = [(x[0], executor.submit(sync_one, *x)) for x in pending]
+                for boundary_id, future in futures:
+                    try:
+                        action = future.result()
+                    except Exception as e:
+                        print("Boundary '{}' failed to sync: {}".format(boundary_id, e))
+                        result.failed[boundary_id] = e
+                        continue
+                    getattr(result, action).append(boundary_id)
+                    with self._lock:
+                        self.manifest.setdefault(farmer_id, {})[boundary_id] = hashes[boundary_id]
+            self._save_manifest()
+
+        result.boundaries = [BoundaryRef(farmer_id, x) for x in hashes if x not in result.failed]
+        return result
+
+
+    def forget(self, farmer_id: str, boundary_ids=None):
+        """ Removes boundaries (all of the farmer if not given) from the manifest, so the next sync sends them """
+        with self._lock:
+            if boundary_ids is None:
+                self.manifest.pop(farmer_id, None)
+            else:
+                for boundary_id in boundary_ids:
+                    self.manifest.get(farmer_id, {}).pop(boundary_id, None)
+        self._save_manifest()
+
+
+    def _get_remote_hash(self, farmer_id, boundary_id):
+        """ Returns the geometry hash of the registered boundary, None if it does not exist """
+        try:
+            remote = self.fb_client.boundaries.get(farmer_id=farmer_id, boundary_id=boundary_id)
+        except ResourceNotFoundError:
+            return None
+        return get_geometry_hash(remote.geometry.coordinates[0])
+
+
+    def _create(self, farmer_id, boundary_id, ring):
+        return self.fb_client.boundaries.create_or_update(
+            farmer_id=farmer_id,
+            boundary_id=boundary_id,
+            boundary=Boundary(description=self.description, geometry=Polygon(coordinates=[ring])),
+        )
+
+
+    def _delete(self, farmer_id, boundary_id):
+        """ Deletes the boundary and its data, waiting for the cascade delete job """
+        poller = self.fb_client.boundaries.begin_create_cascade_delete_job(
+            job_id="boundary-delete-" + str(uuid.uuid1()),
+            farmer_id=farmer_id,
+            boundary_id=boundary_id,
+        )
+        poller.result()
+
+
+    def _load_manifest(self) -> dict:
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+
+    def _save_manifest(self):
+        """ Writes the manifest of this client's endpoint, keeping the other endpoints of the file """
+        def write(file_path):
+            with open(file_path, "w") as f:
+                json.dump(manifest, f)
+
+        with self._lock:
+            manifest = self._load_manifest()
+            manifest[self.endpoint] = self.manifest
+            IOUtil.write_file_atomically(self.manifest_path, write)
@@ -0,0 +1,172 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+# Standard library imports
+import os
+import tempfile
+
+# Third party imports
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+
+# Local imports
+from utils.io_utils import IOUtil
+from utils.tile_util import TileUtil
+
+
+class COGWriter:
+    """
+    Writes a (output_days, height, width) forecast as one multi-band Cloud Optimized GeoTIFF,
+    with one band per forecast day (date in the band description and a "date" tag).
+    Windows can be written one by one, e.g. per tile of a large field. On close, overviews
+    are built on a tiled temporary GeoTIFF, which is then copied to the COG layout. If the
+    with block raises, the temporary GeoTIFF is discarded and an existing file at path is kept.
+
+    with COGWriter("forecast.tif", ras_meta, label_names) as dst:
+        for window, raster in tiles:
+            dst.write_window(raster, window)
+    """
+
+    def __init__(
+        self,
+        path,
+        profile,
+        band_names,
+        blocksize=256,
+        compress="deflate",
+        overview_min_size=32,
+        resampling=Resampling.average,
+    ):
+        """
+        :param path: output file path
+        :param profile: raster profile of the boundary (transform, crs, height, width)
+        :param band_names: forecast dates, one per band
+        :param blocksize: tile width and height in pixels, a multiple of 16
+        :param overview_min_size: smallest overview width or height in pixels
+        """
+        self.path = path
+        self.band_names = list(band_names)
+        self.blocksize = blocksize
+        self.resampling = resampling
+        self.height, self.width = profile["height"], profile["width"]
+        self.transform = profile["transform"]
+        self.overview_levels = CogUtil.get_overview_levels(self.height, self.width, overview_min_size)
+        self.creation_options = dict(
+            tiled=True, blockxsize=blocksize, blockysize=blocksize, compress=compress, predictor=3
+        )
+        # the temporary GeoTIFF is tiled but not compressed, compression is done once by the copy
+        tmp_profile = dict(
+            driver="GTiff",
+            dtype="float32",
+            count=len(self.band_names),
+            height=self.height,
+            width=self.width,
+            transform=self.transform,
+            crs=profile["crs"],
+            nodata=np.nan,
+            tiled=True,
+            blockxsize=blocksize,
+            blockysize=blocksize,
+        )
+        fd, self._tmp_path = tempfile.mkstemp(suffix=".tif", dir=os.path.dirname(os.path.abspath(path)))
+        os.close(fd)
+        self._dst = rasterio.open(self._tmp_path, "w", **tmp_profile)
+        for band, band_name in enumerate(self.band_names, 1):
+            self._dst.set_band_description(band, band_name)
+            self._dst.update_tags(band, date=band_name)
+
+    def write_window(self, raster, window=None):
+        """
+        :param raster: (output_days, window height, window width) array
+        :param window: rasterio Window, the whole raster if not given
+        """
+        self._dst.write(raster.astype("float32", copy=False), window=window)
+
+    def write_predictions(self, pred_df, window=None):
+        """
+        Writes per pixel predictions (label columns, lat and long) of the raster or of a window.
+        Pixels without a prediction are nodata.
+        """
+        if window is None:
+            window = rasterio.windows.Window(0, 0, self.width, self.height)
+        raster = np.full((len(self.band_names), int(window.height), int(window.width)), np.nan, dtype="float32")
+        TileUtil.stitch_predictions(
+            pred_df, self.band_names, raster, rasterio.windows.transform(window, self.transform)
+        )
+        self.write_window(raster, window)
+
+    def close(self):
+        """ Builds overviews and copies the temporary GeoTIFF to the COG file """
+        if self._dst is None:
+            return
+        try:
+            if self.overview_levels:
+                self._dst.build_overviews(self.overview_levels, self.resampling)
+                self._dst.update_tags(ns="rio_overview", resampling=self.resampling.name)
+            self._dst.close()
+            IOUtil.write_file_atomically(self.path, lambda x: rasterio.shutil.copy(
+                self._tmp_path, x, driver="GTiff", copy_src_overviews=True, **self.creation_options
+            ))
+        finally:
+            self.abort()
+
+    def abort(self):
+        """ Discards the temporary GeoTIFF without writing the COG file """
+        if self._dst is None:
+            return
+        self._dst.close()
+        self._dst = None
+        IOUtil.delete_file_safely(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class CogUtil:
+    """
+    Helper methods to write forecast rasters as Cloud Optimized GeoTIFF.
+    """
+
+
+    @staticmethod
+    def get_overview_levels(height: int, width: int, min_size: int = 32) -> list:
+        """ Returns overview decimation factors 2, 4, 8... while the overview is at least min_size pixels """
+        levels = []
+        factor = 2
+        while min(height, width) // factor >= min_size:
+            levels.append(factor)
+            factor *= 2
+        return levels
+
+
+    @staticmethod
+    def write_cog(path: str, raster: np.ndarray, profile: dict, band_names: list, **kwargs) -> str:
+        """
+        Writes a (output_days, height, width) forecast raster as one multi-band COG.
+        :param kwargs: COGWriter options
+        :return: path
+        """
+        with COGWriter(path, profile, band_names, **kwargs) as dst:
+            dst.write_window(raster)
+        return path
+
+
+    @staticmethod
+    def write_predictions_cog(path: str, pred_df: "DataFrame", profile: dict, band_names: list, **kwargs) -> str:
+        """
+        Writes per pixel predictions (as returned by scoring_file.run) as one multi-band COG,
+        pixels without a prediction are nodata.
+        :param kwargs: COGWriter options
+        :return: path
+        """
+        with COGWriter(path, profile, band_names, **kwargs) as dst:
+            dst.write_predictions(pred_df)
+        return path
@@ -0,0 +1,371 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+# Standard library imports
+from datetime import datetime
+
+# Third party imports
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import as_strided
+
+# Local imports
+from utils.ard_quality import FLAG_COLUMNS, QUALITY_FLAGS
+from utils.tile_util import TileUtil
+
+
+class CompactARD:
+    """
+    Analysis Ready Dataset in contiguous arrays instead of lists in object columns.
+    Satellite features are float32 per row (pixel window). Weather is the same for all
+    pixels of a window, so it is stored once per window (float32 or float16) and rows
+    refer to it by window_index. Pixels are kept as raster row and column indexes
+    of the raster transform. Rows are in row major pixel order, then window order.
+    """
+
+    def __init__(
+        self,
+        rows,
+        cols,
+        grp1,
+        window_index,
+        input_evi,
+        output_evi,
+        input_weather,
+        forecast_weather,
+        quality,
+        transform,
+    ):
+        """
+        :param rows, cols: raster row and column index of each ARD row
+        :param grp1: window number of each ARD row, counted from ref_tm
+        :param window_index: index into input_weather and forecast_weather of each ARD row
+        :param input_evi: (rows, input_days, 1) array
+        :param output_evi: (rows, output_days, 1) array
+        :param input_weather: (windows, input_days, weather parameters) array
+        :param forecast_weather: (windows, output_days, weather parameters) array
+        :param quality: QUALITY_FLAGS bitmask of each ARD row
+        :param transform: affine transform of the boundary raster
+        """
+        self.rows = rows
+        self.cols = cols
+        self.grp1 = grp1
+        self.window_index = window_index
+        self.input_evi = input_evi
+        self.output_evi = output_evi
+        self.input_weather = input_weather
+        self.forecast_weather = forecast_weather
+        self.quality = quality
+        self.transform = transform
+
+    def __len__(self):
+        return self.rows.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        """ Size of the arrays in bytes """
+        return sum(
+            x.nbytes
+            for x in [
+                self.rows, self.cols, self.grp1, self.window_index, self.input_evi, self.output_evi,
+                self.input_weather, self.forecast_weather, self.quality,
+            ]
+        )
+
+    def get_coords(self) -> tuple:
+        """ Returns lat and long of each ARD row, upper left pixel corners as in ard_preprocess """
+        return (
+            self.transform.f + self.transform.e * self.rows,
+            self.transform.c + self.transform.a * self.cols,
+        )
+
+    def get_model_inputs(self, index=None) -> list:
+        """
+        Assembles model inputs [input_evi, input_weather, forecast_weather] of all rows or of a batch.
+        Satellite features of all rows are returned without copying, weather is broadcast
+        without copying if all rows share a window (as for scoring), and copied otherwise.
+        :param index: optional slice or integer/boolean array of rows
+        """
+        if index is None:
+            input_evi = self.input_evi
+            window_index = self.window_index
+        else:
+            input_evi = self.input_evi[index]
+            window_index = self.window_index[index]
+        if self.input_weather.shape[0] == 1:
+            n_rows = input_evi.shape[0]
+            return [
+                input_evi,
+                np.broadcast_to(self.input_weather[0], (n_rows,) + self.input_weather.shape[1:]),
+                np.broadcast_to(self.forecast_weather[0], (n_rows,) + self.forecast_weather.shape[1:]),
+            ]
+        return [input_evi, self.input_weather[window_index], self.forecast_weather[window_index]]
+
+    def get_labels(self, index=None) -> np.ndarray:
+        return self.output_evi if index is None else self.output_evi[index]
+
+    def subset(self, index) -> "CompactARD":
+        """ Returns the ARD rows selected by a boolean or integer index, sharing weather arrays """
+        return CompactARD(
+            self.rows[index],
+            self.cols[index],
+            self.grp1[index],
+            self.window_index[index],
+            self.input_evi[index],
+            self.output_evi[index],
+            self.input_weather,
+            self.forecast_weather,
+            self.quality[index],
+            self.transform,
+        )
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """ Converts to the DataFrame layout of ard_preprocess, with list columns """
+        lat, long = self.get_coords()
+        ard = pd.DataFrame(
+            {
+                "lat_": lat,
+                "long_": long,
+                "grp1_": self.grp1.astype(float),
+                "input_evi": self.input_evi.tolist(),
+                "input_weather": self.input_weather[self.window_index].tolist(),
+                "forecast_weather": self.forecast_weather[self.window_index].tolist(),
+                "output_evi": self.output_evi.tolist(),
+            }
+        )
+        for column, flag in FLAG_COLUMNS.items():
+            ard[column] = (self.quality & QUALITY_FLAGS[flag]) == 0
+        ard["quality"] = self.quality
+        return ard
+
+    @staticmethod
+    def empty(input_days, output_days, n_weather, transform, weather_dtype="float32") -> "CompactARD":
+        return CompactARD(
+            np.zeros(0, dtype="int32"),
+            np.zeros(0, dtype="int32"),
+            np.zeros(0, dtype="int32"),
+            np.zeros(0, dtype="int32"),
+            np.zeros((0, input_days, 1), dtype="float32"),
+            np.zeros((0, output_days, 1), dtype="float32"),
+            np.zeros((0, input_days, n_weather), dtype=weather_dtype),
+            np.zeros((0, output_days, n_weather), dtype=weather_dtype),
+            np.zeros(0, dtype=np.uint8),
+            transform,
+        )
+
+
+class SlidingWindowARD:
+    """
+    Input and forecast windows of input_days + output_days every stride days from ref_tm,
+    as strided views over each pixel's daily series and over the weather matrix.
+    Samples are (pixel, window) pairs in row major pixel order, then window order.
+    Windows are only copied when a batch is assembled.
+    """
+
+    def __init__(self, sat, weather, starts, rows, cols, input_days, output_days, stride, first_start, transform):
+        """
+        :param sat: pixels x days float32 satellite series
+        :param weather: days x weather parameters normalized weather
+        :param starts: first day of each window, windows need one weather record on each day
+        :param rows, cols: raster row and column index of each pixel
+        :param first_start: first day of the window from ref_tm
+        :param transform: affine transform of the boundary raster
+        """
+        self.sat = sat
+        self.weather = weather
+        self.starts = starts
+        self.rows = rows
+        self.cols = cols
+        self.input_days = input_days
+        self.output_days = output_days
+        self.stride = stride
+        self.transform = transform
+        self.grp1 = (starts - first_start) // stride
+        window_days = input_days + output_days
+        # strided views (pixels x windows x days and windows x days x parameters) over the windows
+        # from the first start on, starts index them by (start - starts[0]) // stride
+        self._view_index = (starts - starts[0]) // stride if len(starts) > 0 else starts
+        n_views = int(self._view_index[-1]) + 1 if len(starts) > 0 else 0
+        self.sat_windows = _strided_windows(sat, starts[0] if len(starts) > 0 else 0, n_views, window_days, stride, 1)
+        self.weather_windows = _strided_windows(
+            weather, starts[0] if len(starts) > 0 else 0, n_views, window_days, stride, 0
+        )
+        self.quality = self._get_quality()
+
+    def __len__(self):
+        return self.sat.shape[0] * len(self.starts)
+
+    @property
+    def n_windows(self) -> int:
+        return len(self.starts)
+
+    def get_batch(self, index, weather_dtype="float32") -> tuple:
+        """
+        Copies the windows of a batch of samples out of the strided views.
+        :param index: integer array of samples
+        :return: model inputs [input_evi, input_weather, forecast_weather] and labels output_evi
+        """
+        index = np.asarray(index)
+        pixels, windows = np.divmod(index, self.n_windows)
+        sat = self.sat_windows[pixels, self._view_index[windows]]
+        weather = self.weather_windows[self._view_index[windows]].astype(weather_dtype)
+        return (
+            [sat[:, :self.input_days, None], weather[:, :self.input_days], weather[:, self.input_days:]],
+            sat[:, self.input_days:, None],
+        )
+
+    def iter_batches(self, batch_size, index=None, shuffle=False, seed=None, weather_dtype="float32"):
+        """
+        Generates batches of (model inputs, labels).
+        :param index: samples to use, e.g. np.flatnonzero(ard.quality == 0), all samples if not given
+        :param shuffle: shuffle the samples, with seed
+        """
+        index = np.arange(len(self)) if index is None else np.asarray(index)
+        if shuffle:
+            index = np.random.RandomState(seed).permutation(index)
+        for batch_start in range(0, len(index), batch_size):
+            yield self.get_batch(index[batch_start:batch_start + batch_size], weather_dtype)
+
+    def get_coords(self) -> tuple:
+        """ Returns lat and long of each sample, upper left pixel corners as in ard_preprocess """
+        rows = np.repeat(self.rows, self.n_windows)
+        cols = np.repeat(self.cols, self.n_windows)
+        return self.transform.f + self.transform.e * rows, self.transform.c + self.transform.a * cols
+
+    def to_compact(self, weather_dtype="float32") -> CompactARD:
+        """ Copies the windows into a CompactARD, weather stored once per window """
+        n_windows, n_pixels = self.n_windows, self.sat.shape[0]
+        if n_windows == 0 or n_pixels == 0:
+            return CompactARD.empty(
+                self.input_days, self.output_days, self.weather.shape[1], self.transform, weather_dtype
+            )
+        sat = self.sat_windows[:, self._view_index].reshape(n_pixels * n_windows, -1, 1)
+        weather = self.weather_windows[self._view_index]
+        return CompactARD(
+            np.repeat(self.rows, n_windows).astype("int32"),
+            np.repeat(self.cols, n_windows).astype("int32"),
+            np.tile(self.grp1, n_pixels).astype("int32"),
+            np.tile(np.arange(n_windows, dtype="int32"), n_pixels),
+            np.ascontiguousarray(sat[:, :self.input_days]),
+            np.ascontiguousarray(sat[:, self.input_days:]),
+            weather[:, :self.input_days].astype(weather_dtype),
+            weather[:, self.input_days:].astype(weather_dtype),
+            self.quality,
+            self.transform,
+        )
+
+    def _get_quality(self):
+        # flags from per day counts summed over windows, without materializing the windows
+        n_pixels = self.sat.shape[0]
+        bitmask = np.zeros((n_pixels, self.n_windows), dtype=np.uint8)
+        in_start, out_start = self.starts, self.starts + self.input_days
+        sat_nan = np.isnan(self.sat)
+        with np.errstate(invalid="ignore"):
+            sat_gt1 = np.abs(self.sat) > 1
+        weather_nan = np.isnan(self.weather).any(axis=1)
+        for start, days, evi_nan, evi_gt1, weather_flag in [
+            (in_start, self.input_days, "input_evi_nan", "input_evi_gt1", "input_weather_nan"),
+            (out_start, self.output_days, "output_evi_nan", "output_evi_gt1", "forecast_weather_nan"),
+        ]:
+            nan_count = _window_sums(sat_nan, start, days)
+            bitmask[nan_count > 0] |= QUALITY_FLAGS[evi_nan]
+            # rows with only missing values are out of range too, as in get_quality_bitmask
+            bitmask[(nan_count == days) | (_window_sums(sat_gt1, start, days) > 0)] |= QUALITY_FLAGS[evi_gt1]
+            bitmask[:, _window_sums(weather_nan, start, days) > 0] |= QUALITY_FLAGS[weather_flag]
+        return bitmask.ravel()
+
+
+def _strided_windows(array, first_start, n_windows, window_days, stride, axis):
+    """ Read only view of n_windows windows of window_days along the days axis of a 2d array """
+    array = np.ascontiguousarray(array)
+    if axis == 1:  # pixels x days -> pixels x windows x days
+        shape = (array.shape[0], n_windows, window_days)
+        strides = (array.strides[0], array.strides[1] * stride, array.strides[1])
+        base = array[:, first_start:]
+    else:  # days x parameters -> windows x days x parameters
+        shape = (n_windows, window_days, array.shape[1])
+        strides = (array.strides[0] * stride, array.strides[0], array.strides[1])
+        base = array[first_start:]
+    return as_strided(base, shape=shape, strides=strides, writeable=False)
+
+
+def _window_sums(flags, starts, days):
+    """ Sums of boolean flags (..., days) over windows of days from starts, by cumulative sums """
+    cumsum = np.concatenate([np.zeros(flags.shape[:-1] + (1,), dtype="int32"), np.cumsum(flags, axis=-1)], axis=-1)
+    return cumsum[..., starts + days] - cumsum[..., starts]
+
+
+def get_weather_matrix(w_df, w_parms, w_mn, w_sd) -> tuple:
+    """
+    Normalized weather matrix over the weather date range.
+    :return: daily DatetimeIndex, days x parameters array, per day flag of exactly one weather record
+    """
+    w_time = pd.to_datetime(w_df.dateTime.str[:10])
+    idx_time = pd.date_range(w_time.min(), w_time.max())
+    day_ok = w_time.value_counts().reindex(idx_time, fill_value=0).values == 1
+    weather = (
+        ((w_df[w_parms] - w_mn) / np.maximum(w_sd, 0.001))
+        .groupby(w_time.values)
+        .first()
+        .reindex(idx_time)
+        .values
+    )
+    return idx_time, weather, day_ok
+
+
+def build_sliding_window_ard(
+    data_inter, w_df, w_parms, input_days, output_days, ref_tm, w_mn, w_sd, transform, stride=None
+):
+    """
+    Cuts daily interpolated satellite data and normalized weather into input and forecast
+    windows of input_days + output_days, starting every stride days from ref_tm.
+    Windows need one weather record on each day, as in build_ard.
+    :param data_inter: days x pixels DataFrame with (var_name, lat, long) columns
+    :param transform: affine transform of the boundary raster
+    :param stride: days between window starts, input_days + output_days (no overlap) if not given
+    :rtype: SlidingWindowARD
+    """
+    window_days = input_days + output_days
+    stride = stride or window_days
+    idx_time, weather, day_ok = get_weather_matrix(w_df, w_parms, w_mn, w_sd)
+    first_start = (datetime.strptime(ref_tm, "%d-%m-%Y") - idx_time[0]).days
+    # complete windows from ref_tm on
+    starts = np.arange(first_start, len(idx_time) - window_days + 1, stride, dtype="int64")
+    starts = starts[starts >= 0]
+    starts = starts[_window_sums(~day_ok, starts, window_days) == 0]
+
+    # pixels in row major order, as the sorting of ard_preprocess
+    rows, cols = TileUtil.pixel_index(
+        data_inter.columns.get_level_values(-2).values, data_inter.columns.get_level_values(-1).values, transform
+    )
+    order = np.lexsort((cols, rows))
+    # pixels x days, float32 satellite series over the weather date range
+    sat = np.ascontiguousarray(data_inter.iloc[:, order].reindex(idx_time).values.T, dtype="float32")
+    return SlidingWindowARD(
+        sat,
+        np.ascontiguousarray(weather, dtype="float32"),
+        starts,
+        rows[order],
+        cols[order],
+        input_days,
+        output_days,
+        stride,
+        first_start,
+        transform,
+    )
+
+
+def build_compact_ard(
+    data_inter, w_df, w_parms, input_days, output_days, ref_tm, w_mn, w_sd, transform, weather_dtype="float32"
+):
+    """
+    Array version of build_ard: non-overlapping input and forecast windows of
+    input_days + output_days from ref_tm, see build_sliding_window_ard.
+    :param weather_dtype: float32, or float16 to halve weather memory
+    :rtype: CompactARD
+    """
+    if data_inter.shape[1] == 0:
+        return CompactARD.empty(input_days, output_days, len(w_parms), transform, weather_dtype)
+    return build_sliding_window_ard(
+        data_inter, w_df, w_parms, input_days, output_days, ref_tm, w_mn, w_sd, transform
+    ).to_compact(weather_dtype)
@@ -9,6 +9,7 @@ that includes options for AKS compute, input days and output days specs, filenam
 CONSTANTS= {
     # data directories
     "root_dir": "/tmp/farmbeats",  # Store the satellite and weather data
+    "weather_cell_deg": 0.05,  # boundaries with centroids in the same cell of this size (degrees) share weather
 
     # model specs
     "input_days": 30,  # input number of days for NDVI/EVI and weather
@@ -20,6 +21,7 @@ CONSTANTS= {
     
     # deployment
     "deploy_pretrained":True, # Change it to True for deploying pre-trained model
+    "max_tile_workers": 8,  # upper bound of the tile_workers request parameter
     
     # model results filenames
     "results_dir": "results/",
@@ -1,9 +1,16 @@
 # Copyright (c) Microsoft. All rights reserved.
 # Licensed under the MIT license.
 
+# Standard library imports
+from functools import lru_cache
+
 # Third party imports
 import geojson
-from shapely.geometry import Polygon, MultiPolygon
+import numpy as np
+from rasterio.features import geometry_mask
+from rasterio.transform import Affine
+from rasterio.warp import transform_geom
+from shapely.geometry import Polygon, MultiPolygon, mapping
 from shapely.geometry.base import BaseGeometry
 
 
@@ -23,11 +30,10 @@ class GeojsonUtil:
         """
         shape_json = geojson.loads(geo_json)
         if shape_json.type == 'Polygon':
-            return Polygon(shape_json.coordinates[0])
+            return Polygon(shape_json.coordinates[0], shape_json.coordinates[1:])
 
         elif shape_json.type == 'MultiPolygon':
-            polygons = list(shape_json.coordinates)
-            return MultiPolygon(polygons, context_type='geojson')
+            return MultiPolygon([Polygon(x[0], x[1:]) for x in shape_json.coordinates])
 
         else:
             raise ValueError("Expected geojson type Polygon or MultiPolygon, but provided: %s",
@@ -67,3 +73,34 @@ class GeojsonUtil:
         ]
 
         return {"type": "Polygon", "coordinates": [bounding_rect_coordinates]}
+
+
+    @staticmethod
+    def geojson_to_mask(geo_json: str, transform, out_shape: tuple, crs=None, all_touched: bool = False) -> np.ndarray:
+        """
+        returns mask of raster pixels inside the Polygon/MultiPolygon of given geo_json.
+        Masks are cached per geometry and raster grid, so that they are built once per boundary.
+        :param str geo_json: input geojson string (EPSG:4326)
+        :param transform: affine transform of the raster grid
+        :param tuple out_shape: raster (height, width)
+        :param crs: raster crs, geometry is reprojected if it is not EPSG:4326
+        :param bool all_touched: include all pixels touched by the geometry, else pixels with center inside
+        :return: read-only boolean array, True for pixels inside the geometry
+        :rtype: np.ndarray
+        """
+        return GeojsonUtil._geojson_to_mask_cached(
+            geo_json, tuple(transform), tuple(out_shape), None if crs is None else str(crs), all_touched
+        )
+
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _geojson_to_mask_cached(geo_json, transform, out_shape, crs, all_touched):
+        geometry = mapping(GeojsonUtil.geojson_to_polygon(geo_json))
+        if crs is not None and crs != "EPSG:4326":
+            geometry = transform_geom("EPSG:4326", crs, geometry)
+        mask = geometry_mask(
+            [geometry], out_shape=out_shape, transform=Affine(*transform[:6]), all_touched=all_touched, invert=True
+        )
+        mask.setflags(write=False)
+        return mask
@@ -0,0 +1,136 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+# Standard library imports
+from collections import OrderedDict
+from threading import Lock
+
+# Third party imports
+import numpy as np
+import rasterio
+
+
+class BoundaryGrid:
+    """
+    Raster grid of a boundary: transform, profile, coordinate vectors and
+    validity mask (pixels with a non-zero value in at least one of the current scenes).
+    The non-zero pixels of each scene are kept bit packed, so scenes which leave the
+    stack are removed from the mask without reading them again.
+    """
+
+    def __init__(self, boundary_id, profile):
+        self.boundary_id = boundary_id
+        self.profile = profile
+        self.transform = profile["transform"]
+        self.crs = profile["crs"]
+        self.shape = (profile["height"], profile["width"])
+        # upper left pixel corners, as used for lat and long in the ARD
+        self.lat = self.transform.f + self.transform.e * np.arange(self.shape[0])
+        self.long = self.transform.c + self.transform.a * np.arange(self.shape[1])
+        self.valid_mask = np.zeros(self.shape, dtype=bool)
+        self.scene_masks = OrderedDict()  # file path: packed non-zero pixels
+        self.lock = Lock()  # held by GridCache while scenes are added
+
+    @property
+    def scene_paths(self):
+        return set(self.scene_masks)
+
+    def update(self, file_paths):
+        """
+        Updates the validity mask to the given scenes: scenes not seen before are read, instead
+        of rescanning all scenes, and scenes no longer given (e.g. aged out) are dropped.
+        :param file_paths: local paths of the boundary scenes
+        :return: number of new scenes
+        """
+        file_paths = list(OrderedDict.fromkeys(map(str, file_paths)))
+        removed_paths = set(self.scene_masks).difference(file_paths)
+        new_paths = [x for x in file_paths if x not in self.scene_masks]
+        new_masks = []
+        for file_path in new_paths:
+            with rasterio.open(file_path) as src:
+                if src.transform != self.transform or src.shape != self.shape:
+                    raise ValueError(
+                        "Scene {} does not match the grid of boundary {}".format(file_path, self.boundary_id)
+                    )
+                new_masks.append(src.read(1) != 0)
+        for file_path in removed_paths:
+            del self.scene_masks[file_path]
+        for file_path, mask in zip(new_paths, new_masks):
+            self.scene_masks[file_path] = np.packbits(mask, axis=None)
+
+        if removed_paths:
+            # rebuilt from the kept scenes, the mask of a removed scene can't be subtracted
+            valid_mask = np.zeros(self.shape[0] * self.shape[1], dtype=bool)
+            for packed in self.scene_masks.values():
+                valid_mask |= np.unpackbits(packed, count=valid_mask.size).astype(bool)
+            self.valid_mask = valid_mask.reshape(self.shape)
+        elif new_masks:
+            # a new array, so readers never see a partly updated mask
+            self.valid_mask = np.logical_or.reduce([self.valid_mask] + new_masks)
+        return len(new_paths)
+
+    def get_valid_mask(self, sat_res_x=1, window=None):
+        return self.valid_mask[self._slices(sat_res_x, window)]
+
+    def get_coords(self, sat_res_x=1, window=None):
+        """ Returns lat and long vectors of the (sampled) pixels of the grid or of a window """
+        rows, cols = self._slices(sat_res_x, window)
+        return self.lat[rows], self.long[cols]
+
+    def _slices(self, sat_res_x, window):
+        if window is None:
+            return slice(None, None, sat_res_x), slice(None, None, sat_res_x)
+        rows, cols = window.toslices()
+        return slice(rows.start, rows.stop, sat_res_x), slice(cols.start, cols.stop, sat_res_x)
+
+
+class GridCache:
+    """
+    Cache of BoundaryGrid per boundary id and raster transform. A boundary's entry is
+    replaced when its scenes come on a different grid, and can be invalidated explicitly.
+    Least recently used entries are evicted beyond max_size boundaries. Scenes are read
+    under the lock of their grid only, so boundaries are updated concurrently.
+    """
+
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self._grids = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, boundary_id, sat_file_links) -> BoundaryGrid:
+        """
+        Returns the grid of a boundary, updated with the scenes of sat_file_links.
+        :param boundary_id: boundary id
+        :param sat_file_links: DataFrame with filePath of the boundary scenes
+        :rtype: BoundaryGrid
+        """
+        file_paths = sat_file_links.filePath.values
+        with rasterio.open(file_paths[0]) as src:
+            profile = src.profile
+
+        with self._lock:
+            grid = self._grids.pop(boundary_id, None)
+            if grid is None or grid.transform != profile["transform"] or grid.shape != (
+                profile["height"], profile["width"]
+            ):
+                grid = BoundaryGrid(boundary_id, profile)
+            self._grids[boundary_id] = grid
+            while len(self._grids) > self.max_size:
+                self._grids.popitem(last=False)
+        with grid.lock:
+            grid.update(file_paths)
+        return grid
+
+    def invalidate(self, boundary_id=None):
+        """ Removes the grid of a boundary, or all grids if no boundary id is given """
+        with self._lock:
+            if boundary_id is None:
+                self._grids.clear()
+            else:
+                self._grids.pop(boundary_id, None)
+
+    def __contains__(self, boundary_id):
+        return boundary_id in self._grids
+
+    def __len__(self):
+        return len(self._grids)
@@ -0,0 +1,264 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+# Standard library imports
+from datetime import datetime, timedelta
+from threading import Lock
+
+# Third party imports
+import numpy as np
+import pandas as pd
+import rasterio
+from statsmodels.nonparametric.smoothers_lowess import lowess
+
+# Local imports
+from utils.ard_util import build_ard, read_sat_data_array
+from utils.compact_ard import build_compact_ard
+
+
+class _BoundaryState:
+    """ Observed, smoothed and daily interpolated satellite data of a boundary """
+
+    def __init__(self):
+        self.scene_dates = {}  # file path: date, of the scenes in the request's stack
+        self.observed = None  # scene dates x pixels
+        self.smoothed = None  # scene dates x pixels
+        self.span = None  # LOWESS neighbourhood of the smoothed data
+        self.interpolated = None  # days x pixels
+        self.transform = None  # boundary raster transform
+        self.shape = None  # boundary raster height and width
+        self.boundary_geometry = None
+        self.lock = Lock()
+
+
+class IncrementalARD:
+    """
+    Keeps each boundary's smoothed and interpolated satellite data, so that appending
+    new scenes only recomputes the LOWESS fits of the trailing span, instead of the whole
+    season. The cubic interpolation is global, so it is recomputed over the retained window.
+
+    Scenes no longer in sat_file_links (e.g. older than the request's satellite window) are
+    dropped, as in BoundaryGrid.update. The LOWESS neighbourhood is int(frac * n) scenes as in
+    ard_preprocess. Appends which change it (one in 1 / frac as scenes are added, or when
+    scenes are dropped), the first append of a boundary and the first append after its grid
+    or geometry changed refit all scenes, so results match a full recompute over the scenes
+    of sat_file_links, unless max_history_days drops some of them.
+    """
+
+    def __init__(
+        self,
+        var_name,
+        w_parms,
+        w_mn,
+        w_sd,
+        input_days,
+        output_days,
+        sat_res_x=1,
+        frac=0.2,
+        max_history_days=None,
+    ):
+        """
+        :param frac: LOWESS fraction of scenes used for each fit, as in ard_preprocess
+        :param max_history_days: drop state older than this many days before the last scene,
+            even if its scenes are still given
+        """
+        self.var_name = var_name
+        self.w_parms = w_parms
+        self.w_mn = w_mn
+        self.w_sd = w_sd
+        self.input_days = input_days
+        self.output_days = output_days
+        self.sat_res_x = sat_res_x
+        self.frac = frac
+        self.max_history_days = max_history_days
+        self._states = {}
+        self._lock = Lock()
+
+    def append_scenes(self, boundary_id, sat_file_links, boundary_geometry=None, grid=None):
+        """
+        Adds scenes not seen before to the state of a boundary, drops scenes no longer given and
+        updates the smoothed and interpolated data (of the affected trailing window if no scene
+        was dropped).
+        :param sat_file_links: DataFrame with filePath and sceneDateTime of the boundary scenes
+        :param boundary_geometry: optional geojson string, pixels outside of it are dropped
+        :param grid: optional BoundaryGrid, keeps the always zero mask consistent across appends
+        :return: number of new scenes
+        """
+        if grid is not None:
+            transform, shape = grid.transform, grid.shape
+        else:
+            with rasterio.open(sat_file_links.filePath.values[0]) as src:
+                transform, shape = src.transform, src.shape
+
+        with self._lock:
+            state = self._states.get(boundary_id)
+            # a new grid (e.g. replaced in GridCache) or geometry (e.g. a recreated boundary) starts over,
+            # so that pixels of different grids are never mixed
+            if state is None or (state.transform, state.shape, state.boundary_geometry) != (
+                transform, shape, boundary_geometry
+            ):
+                state = self._states[boundary_id] = _BoundaryState()
+                state.transform, state.shape, state.boundary_geometry = transform, shape, boundary_geometry
+
+        with state.lock:
+            file_paths = sat_file_links.filePath.astype(str)
+            removed_paths = set(state.scene_dates).difference(file_paths)
+            new_links = sat_file_links[~file_paths.isin(state.scene_dates)]
+            if new_links.shape[0] == 0 and not removed_paths:
+                return 0
+
+            observed = self._drop_scenes(state, removed_paths)
+            data_new = None
+            if new_links.shape[0] > 0:
+                data_new = read_sat_data_array(
+                    new_links, self.sat_res_x, self.var_name, boundary_geometry=boundary_geometry, grid=grid
+                )
+                scene_dates = pd.to_datetime(pd.to_datetime(new_links.sceneDateTime).dt.date)
+                state.scene_dates.update(zip(new_links.filePath.astype(str), scene_dates))
+            if data_new is None and not removed_paths:
+                return new_links.shape[0]
+
+            if data_new is not None:
+                data_new.index = pd.to_datetime(data_new.index)
+                if observed is None:
+                    observed = data_new
+                else:
+                    # pixels always zero in the new or in the previous scenes are zero, as in ard_preprocess
+                    observed = pd.concat([observed, data_new]).fillna(0)
+                    observed = observed[~observed.index.duplicated(keep="last")]
+            if observed is None or observed.shape[0] == 0:
+                state.observed = state.smoothed = state.interpolated = state.span = None
+                return new_links.shape[0]
+            observed = observed.sort_index()
+
+            first_new = 0 if data_new is None else observed.index.get_loc(data_new.index.min())
+            self._update(state, observed, first_new)
+            self._trim(state)
+        return new_links.shape[0]
+
+    def get_interpolated(self, boundary_id):
+        """ Returns daily interpolated data (days x pixels) of a boundary """
+        return self._states[boundary_id].interpolated
+
+    def get_ard(self, boundary_id, w_df, ref_tm=None, compact=False, weather_dtype="float32"):
+        """
+        Creates ARD windows from ref_tm on, using the state of the boundary.
+        :param w_df: weather DataFrame (historical and forecast) as for ard_preprocess
+        :param ref_tm: reference time "%d-%m-%Y", defaults to input_days before the last scene
+            (the latest input/forecast window)
+        :param compact: return a CompactARD instead of a DataFrame, see ard_preprocess
+        :return: ARD DataFrame in the layout of ard_preprocess
+        """
+        state = self._states[boundary_id]
+        with state.lock:
+            interpolated, transform = state.interpolated, state.transform
+        if ref_tm is None:
+            ref_tm = (interpolated.index[-1] - timedelta(days=self.input_days - 1)).strftime("%d-%m-%Y")
+        ref_dt = datetime.strptime(ref_tm, "%d-%m-%Y")
+
+        # only data from ref_tm on is windowed
+        w_df = w_df[w_df.dateTime.str[:10] >= ref_dt.strftime("%Y-%m-%d")]
+        if compact:
+            return build_compact_ard(
+                interpolated[interpolated.index >= ref_dt],
+                w_df,
+                self.w_parms,
+                self.input_days,
+                self.output_days,
+                ref_tm,
+                self.w_mn,
+                self.w_sd,
+                transform,
+                weather_dtype,
+            )
+        return build_ard(
+            interpolated[interpolated.index >= ref_dt],
+            w_df,
+            self.var_name,
+            self.w_parms,
+            self.input_days,
+            self.output_days,
+            ref_tm,
+            self.w_mn,
+            self.w_sd,
+        )
+
+    def reset(self, boundary_id=None):
+        """ Drops the state of a boundary, or of all boundaries if no boundary id is given """
+        with self._lock:
+            if boundary_id is None:
+                self._states.clear()
+            else:
+                self._states.pop(boundary_id, None)
+
+    def __contains__(self, boundary_id):
+        return boundary_id in self._states
+
+    def _drop_scenes(self, state, removed_paths):
+        """
+        Removes scenes from the state and returns the observed data of the kept scenes. Pixels zero in
+        all kept scenes are dropped, as in read_sat_data_array, and all fits are redone by the next update.
+        """
+        if not removed_paths:
+            return state.observed
+        for file_path in removed_paths:
+            del state.scene_dates[file_path]
+        state.span = None
+        if state.observed is None:
+            return None
+        observed = state.observed[state.observed.index.isin(set(state.scene_dates.values()))]
+        return observed.loc[:, (observed != 0).any()]
+
+    def _update(self, state, observed, first_new):
+        n_scenes = observed.shape[0]
+        span = int(self.frac * n_scenes + 1e-10)  # LOWESS neighbourhood, as in statsmodels
+        new_cols = observed.columns if state.smoothed is None else observed.columns.difference(
+            state.smoothed.columns
+        )
+        old_cols = observed.columns.difference(new_cols)
+
+        # fits within span of the new scenes change, and need span scenes before them;
+        # all fits change when the neighbourhood grows with the scene count
+        start = 0 if state.smoothed is None or span != state.span else max(0, first_new - span)
+        fit_from = max(0, start - span)
+        smoothed = pd.DataFrame(np.nan, index=observed.index, columns=observed.columns)
+        if start > 0:
+            smoothed.iloc[:start] = state.smoothed.reindex(columns=observed.columns).iloc[:start].values
+        if len(old_cols) > 0:
+            smoothed.loc[observed.index[start:], old_cols] = self._lowess(
+                observed[old_cols].iloc[fit_from:], span
+            ).iloc[start - fit_from:].values
+        if len(new_cols) > 0:
+            smoothed[new_cols] = self._lowess(observed[new_cols], span).values
+
+        # the cubic spline is global, so the whole retained window is interpolated again (cheap next to LOWESS)
+        interpolated = self._interpolate(smoothed)
+
+        state.observed, state.smoothed, state.interpolated = observed, smoothed, interpolated
+        state.span = span
+
+    def _lowess(self, data, span):
+        xvals = (data.index - data.index[0]).days.values
+        frac = min(1.0, span / data.shape[0])
+        return pd.DataFrame(
+            {
+                x: lowess(data[x].values, xvals, is_sorted=True, frac=frac, it=0)[:, 1]
+                for x in data.columns
+            },
+            index=data.index,
+        )[data.columns]
+
+    def _interpolate(self, smoothed):
+        idx = pd.date_range(smoothed.index[0], smoothed.index[-1])
+        return (
+            smoothed.reindex(idx, fill_value=np.nan)
+            .interpolate(method="cubic", limit_direction="both", limit=100)
+        )
+
+    def _trim(self, state):
+        if self.max_history_days is None:
+            return
+        first_day = state.observed.index[-1] - timedelta(days=self.max_history_days)
+        state.observed = state.observed[state.observed.index >= first_day]
+        state.smoothed = state.smoothed[state.smoothed.index >= first_day]
+        state.interpolated = state.interpolated[state.interpolated.index >= first_day]
@@ -3,6 +3,7 @@
 
 # Standard library imports
 import os
+import tempfile
 
 
 class IOUtil:
@@ -21,6 +22,25 @@ class IOUtil:
             os.remove(file_path)
 
 
+    @staticmethod
+    def write_file_atomically(file_path: str, write):
+        """
+        Writes a file with write(tmp_path) to a temporary file in the same dir, which then
+        replaces file_path, so readers never see a partial file
+        :param write: function writing the file content to the given path
+        """
+        file_dir = os.path.dirname(os.path.abspath(file_path))
+        IOUtil.create_dir_safely(file_dir)
+        fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(file_path)[1], dir=file_dir)
+        os.close(fd)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            IOUtil.delete_file_safely(tmp_path)
+            raise
+
+
     @staticmethod
     def get_file_size_in_MBs(file_path: str) -> float:
         """ Returns the size of file in MBs"""
@@ -18,17 +18,20 @@ warnings.filterwarnings("ignore")
 # Third party library imports
 import numpy as np
 import pandas as pd
-import rasterio
 import tensorflow as tf
 from tensorflow import keras
 
 # Local imports
-from utils.ard_util import ard_preprocess
+from utils.ard_quality import QualityReport
+from utils.ard_util import ard_preprocess, ard_preprocess_tiled
+from utils.boundary_sync import get_client_endpoint
 from utils.config import farmbeats_config
 from utils.constants import CONSTANTS
+from utils.grid_cache import GridCache
+from utils.incremental_ard import IncrementalARD
 from utils.satellite_util import SatelliteUtil
 from utils.test_helper import get_sat_weather_data, get_timezone
-from utils.weather_util import WeatherUtil
+from utils.weather_cache import WeatherCache
 
 # Azure imports
 from azure.identity import ClientSecretCredential
@@ -39,6 +42,13 @@ from azure.agrifood.farming import FarmBeatsClient
 
 # -
 
+# Raster grid and always zero mask per boundary, reused across requests
+grid_cache = GridCache()
+# Smoothed and interpolated satellite data per boundary, for incremental requests
+incremental_ard = None
+# Weather per weather cell, shared by neighbouring boundaries, per FarmBeats endpoint of the requests
+weather_caches = {}
+
 # Called when the deployed service starts
 def init():
     global model
@@ -73,24 +83,24 @@ def call_farmbeats(farmbeats_config):
     )
     return fb_client
 
-def get_ARD_df_scoring(fb_client, farmer_id, boundary_id, boundary_geometry):
+def get_sat_weather_df_scoring(fb_client, farmer_id, boundary_id, boundary_geometry):
+    """
+    Ingests and downloads satellite data of last 60 days and weather data (historical and forecast)
+    :return: satellite file links, weather DataFrame and date of last available scene
+    """
     timezone = get_timezone(boundary_geometry)
     end_dt = datetime.strptime(datetime.now(timezone).strftime("%Y-%m-%d"), "%Y-%m-%d")
     start_dt = end_dt - timedelta(days=60)
 
     # Create Boundary and get satelite and weather (historical and forecast)
-    get_sat_weather_data(fb_client, 
+    weather_cache = get_weather_cache(fb_client)
+    boundary = get_sat_weather_data(fb_client, 
                     farmer_id, 
                     boundary_id,
                     boundary_geometry, 
                     start_dt, 
-                    end_dt)
-
-    # get boundary object
-    boundary = fb_client.boundaries.get(
-                farmer_id=farmer_id,
-                boundary_id=boundary_id
-            )
+                    end_dt,
+                    weather_cache=weather_cache)
     
     root_dir = CONSTANTS['root_dir']
     sat_links = SatelliteUtil(farmbeats_client = fb_client).download_and_get_sat_file_paths(farmer_id, [boundary], start_dt, end_dt, root_dir)
@@ -103,40 +113,27 @@ def get_ARD_df_scoring(fb_client, farmer_id, boundary_id, boundary_geometry):
     start_dt_w = end_dt_w - timedelta(days=CONSTANTS["input_days"] - 1)
     
     
-    # get weather data historical
-    weather_list = fb_client.weather.list(
-                farmer_id=  boundary.farmer_id,
-                boundary_id= boundary.id,
-                start_date_time=start_dt_w,
-                end_date_time=end_dt,
-                extension_id=farmbeats_config['weather_provider_extension_id'],
-                weather_data_type= "historical", 
-                granularity="daily")
-    weather_data = []
-    for w_data in weather_list:
-        weather_data.append(w_data)
-    w_df_hist = WeatherUtil.get_weather_data_df(weather_data)
-    
-    
-    # get weather data forecast
-    weather_list = fb_client.weather.list(
-                farmer_id=  boundary.farmer_id,
-                boundary_id= boundary.id,
-                start_date_time=end_dt,
-                end_date_time=end_dt + timedelta(10),
-                extension_id=farmbeats_config['weather_provider_extension_id'], 
-                weather_data_type= "forecast", 
-                granularity="daily")
-
-    weather_data = []
-    for w_data in weather_list:
-        weather_data.append(w_data)
-    w_df_forecast = WeatherUtil.get_weather_data_df(weather_data)
+    # get weather data historical and forecast, shared by the boundaries of a weather cell
+    # historical weather is cached for the ingested date range and sliced to the input window
+    w_df_hist = weather_cache.get_weather_df(fb_client, farmer_id, boundary_id, "historical", start_dt, end_dt)
+    if w_df_hist is not None:
+        w_df_hist = w_df_hist[w_df_hist.dateTime.str[:10] >= start_dt_w.strftime("%Y-%m-%d")]
+    w_df_forecast = weather_cache.get_weather_df(
+        fb_client, farmer_id, boundary_id, "forecast", end_dt, end_dt + timedelta(10)
+    )
     
     weather_df = pd.concat([w_df_hist, w_df_forecast], axis=0, ignore_index=True)
-    
-    ard = ard_preprocess(
-        sat_file_links=sat_links,
+
+    return sat_links, weather_df, end_dt_w
+
+def get_boundary_geojson(boundary_geometry):
+    # geojson string of the boundary polygon ring (list of longitude, latitude)
+    return json.dumps({"type": "Polygon", "coordinates": [boundary_geometry]})
+
+def get_ard_parms_scoring(weather_df, end_dt_w, boundary_geometry):
+    # ard_preprocess arguments (except satellite file links) for scoring
+    start_dt_w = end_dt_w - timedelta(days=CONSTANTS["input_days"] - 1)
+    return dict(
         w_df=weather_df,
         sat_res_x=1,
         var_name=CONSTANTS["var_name"],
@@ -148,24 +145,128 @@ def get_ARD_df_scoring(fb_client, farmer_id, boundary_id, boundary_geometry):
         ref_tm=start_dt_w.strftime("%d-%m-%Y"),
         w_mn=weather_mean,
         w_sd=weather_std,
+        boundary_geometry=get_boundary_geojson(boundary_geometry),
+        compact=True,
     )
 
-    frcst_st_dt  = end_dt_w
-    
-    ref_tif = sat_links.filePath.values[0]
-    with rasterio.open(ref_tif) as src:
-        ras_meta = src.profile
+def get_ras_meta(grid):
+    # raster profile of the boundary grid and its json serializable encoding
+    ras_meta = grid.profile
      
     ras_meta_enoded = dict(ras_meta)
     ras_meta_enoded['crs'] = str((dict(ras_meta))['crs'])
-    right,bottom = src.transform * ( ras_meta['width'], ras_meta['height']) 
+    right,bottom = grid.transform * ( ras_meta['width'], ras_meta['height']) 
     transform = list(ras_meta['transform'])
     left, top = transform[2], transform[5]
     #dst_left, dst_bottom, dst_right, dst_top, width, height
     ras_meta_enoded['transform'] = [left, bottom, right, top, ras_meta['width'], ras_meta['height']]
+    return ras_meta, ras_meta_enoded
+
+def get_incremental_ard():
+    # created on first use, after the weather normalization stats are loaded
+    global incremental_ard
+    if incremental_ard is None:
+        incremental_ard = IncrementalARD(
+            var_name=CONSTANTS["var_name"],
+            w_parms=w_parms,
+            w_mn=weather_mean,
+            w_sd=weather_std,
+            input_days=CONSTANTS["input_days"],
+            output_days=CONSTANTS["output_days"],
+            max_history_days=60,
+        )
+    return incremental_ard
+
+def get_weather_cache(fb_client):
+    # created on first use of the client endpoint, under the root dir at that time
+    endpoint = get_client_endpoint(fb_client)
+    if endpoint not in weather_caches:
+        weather_caches[endpoint] = WeatherCache(endpoint=endpoint)
+    return weather_caches[endpoint]
+
+def get_ARD_df_scoring(fb_client, farmer_id, boundary_id, boundary_geometry, incremental=False):
+    """
+    Prepares ARD of the latest input and forecast window of a boundary. With incremental,
+    only scenes not seen in previous requests are read and smoothed.
+    """
+    sat_links, weather_df, end_dt_w = get_sat_weather_df_scoring(
+        fb_client, farmer_id, boundary_id, boundary_geometry
+    )
+    
+    grid = grid_cache.get(boundary_id, sat_links)
+    ard_parms = get_ard_parms_scoring(weather_df, end_dt_w, boundary_geometry)
+    if incremental:
+        get_incremental_ard().append_scenes(
+            boundary_id, sat_links, boundary_geometry=ard_parms["boundary_geometry"], grid=grid
+        )
+        ard = incremental_ard.get_ard(boundary_id, weather_df, ref_tm=ard_parms["ref_tm"], compact=True)
+    else:
+        ard = ard_preprocess(sat_file_links=sat_links, grid=grid, **ard_parms)
+
+    frcst_st_dt  = end_dt_w
+    
+    _, ras_meta_enoded = get_ras_meta(grid)
         
     return ard, frcst_st_dt, ras_meta_enoded
 
+def check_ard(ard):
+    """
+    Raises exception if data spills into multiple rows
+    :return: list of warnings for nans or out of bounds data
+    """
+    quality_report = QualityReport(ard)
+    # raise exception if data spills into multiple rows
+    if quality_report.multi_window_rows > 0:
+        raise Exception(
+            "More than one record has been found for more than one pixel"
+        )
+    # warning if nans are in input data or data is out of bounds
+    return quality_report.get_warnings()
+
+def get_label_names(frcst_st_dt):
+    return [
+        (frcst_st_dt + timedelta(days=i + 1)).strftime("%Y-%m-%d")
+        for i in range(CONSTANTS["output_days"])
+    ]
+
+def predict_ard(ard, frcst_st_dt):
+    # model prediction on a CompactARD
+    label = model.predict(ard.get_model_inputs())
+    lat, long = ard.get_coords()
+    return pd.DataFrame(label[:, :, 0], columns=get_label_names(frcst_st_dt)).assign(lat=lat, long=long)
+
+def get_tiled_predictions(fb_client, farmer_id, boundary_id, boundary_geometry, tile_size, tile_workers=1):
+    """
+    Prepares ARD and predicts tile by tile, so that memory is bounded by tile size instead of field size.
+    :return: prediction DataFrame of the predicted pixels (as predict_ard, tile by tile), encoded raster metadata
+    """
+    sat_links, weather_df, end_dt_w = get_sat_weather_df_scoring(
+        fb_client, farmer_id, boundary_id, boundary_geometry
+    )
+    grid = grid_cache.get(boundary_id, sat_links)
+    _, ras_meta_enoded = get_ras_meta(grid)
+
+    pred_dfs = []
+    ard_warnings = []
+    for _, ard in ard_preprocess_tiled(
+        sat_links,
+        tile_size=tile_size,
+        max_workers=tile_workers,
+        grid=grid,
+        **get_ard_parms_scoring(weather_df, end_dt_w, boundary_geometry)
+    ):
+        if len(ard) == 0:
+            continue
+        ard_warnings.extend(x for x in check_ard(ard) if x not in ard_warnings)
+        pred_dfs.append(predict_ard(ard, end_dt_w))
+
+    # raise exception if ARD is empty
+    if not pred_dfs:
+        raise Exception("Analysis ready dataset is empty")
+    for warning in ard_warnings:
+        print(warning)
+    return pd.concat(pred_dfs, ignore_index=True), ras_meta_enoded
+
 # Handle requests to the service
 def run(data):
     try:
@@ -177,9 +278,26 @@ def run(data):
         sat_res_x = parms.get("sat_res_x", 1)
         var_name = parms.get("var_name", "NDVI")
         sat_data_days = parms.get("sat_data_days", 60)
+        # tile size in pixels for large boundaries, whole boundary is processed at once if not given
+        tile_size = parms.get("tile_size")
+        tile_workers = max(1, min(int(parms.get("tile_workers", 1)), CONSTANTS["max_tile_workers"]))
+        # reuse smoothed satellite data of previous requests for the boundary
+        incremental = parms.get("incremental", False)
         if sat_data_days < 30:
             sat_data_days = 60
             print("Note: Satellite data for last 60 days will be downloaded")
+
+        if tile_size:
+            tmp_df, ras_meta = get_tiled_predictions(
+                fb_client,
+                farmer_id,
+                boundary_id,
+                boundary_geometry,
+                tile_size,
+                tile_workers
+                )
+            result = {'ras_meta': ras_meta, 'model_preds': tmp_df.to_dict()}
+            return result
             
         # prepare ARD for new data
         # frcst_st_dt reprresents last available scene of satellite
@@ -188,46 +306,18 @@ def run(data):
             fb_client, 
             farmer_id,
             boundary_id, 
-            boundary_geometry
+            boundary_geometry,
+            incremental
             )
         
         # raise exception if ARD is empty
-        if ard.shape[0] == 0:
+        if len(ard) == 0:
             raise Exception("Analysis ready dataset is empty")
-        # raise exception if data spills into multiple rows
-        if ard.query("grp1_ > 0").shape[0] > 0:
-            raise Exception(
-                "More than one record has been found for more than one pixel"
-            )
         # warning if nans are in input data or data is out of bounds
-        if (
-            ard.query("not nan_input_evi").shape[0] > 0
-            or ard.query("not nan_input_w").shape[0] > 0
-            or ard.query("not nan_output_w").shape[0] > 0
-        ):
-            print("Warning: NaNs found in the input data")
-        if (
-            ard.query(
-                "nan_input_evi and nan_input_w and nan_output_w and  not input_evi_le1"
-            ).shape[0]
-            > 0
-        ):
-            print("Warning: input data outside range of (-1,1) found")
+        for warning in check_ard(ard):
+            print(warning)
         # model prediction
-        label = model.predict(
-            [
-                np.array(ard.input_evi.to_list()),
-                np.array(ard.input_weather.to_list()),
-                np.array(ard.forecast_weather.to_list()),
-            ]
-        )
-        label_names = [
-            (frcst_st_dt + timedelta(days=i + 1)).strftime("%Y-%m-%d")
-            for i in range(CONSTANTS["output_days"])
-        ]
-        tmp_df = pd.DataFrame(label[:, :, 0], columns=label_names).assign(
-            lat=ard.lat_.values, long=ard.long_.values
-        )
+        tmp_df = predict_ard(ard, frcst_st_dt)
 
         # Prepare result and return output
         result = {'ras_meta': ras_meta, 'model_preds': tmp_df.to_dict()}
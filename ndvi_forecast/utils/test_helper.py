@@ -16,18 +16,28 @@ import timezonefinder
 from shapely import geometry
 
 # Local imports
+from utils.boundary_sync import BoundarySync, get_client_endpoint
 from utils.config import farmbeats_config
+from utils.weather_cache import WeatherCache
 
 # Library specific imports
 from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
 from azure.agrifood.farming import FarmBeatsClient
-from azure.agrifood.farming.models import (Farmer, Boundary, Polygon,
+from azure.agrifood.farming.models import (Farmer,
                                     SatelliteDataIngestionJob,
                                     WeatherDataIngestionJob, 
                                     SatelliteData)
 
 
-def get_sat_weather_data(fb_client, farmer_id, boundary_id, boundary_polygon, start_dt, end_dt):
+def get_sat_weather_data(fb_client, farmer_id, boundary_id, boundary_polygon, start_dt, end_dt, weather_cache=None):
+    """
+    Registers the farmer and boundary if needed, and ingests satellite and weather (historical and forecast) data
+    :param weather_cache: WeatherCache of the weather cells of the client endpoint, weather is not ingested
+        again for a cell and date range
+    :return: BoundaryRef of the boundary
+    """
+    if weather_cache is None:
+        weather_cache = WeatherCache(endpoint=get_client_endpoint(fb_client))
 
     # Create Farmer
     try:
@@ -40,31 +50,16 @@ def get_sat_weather_data(fb_client, farmer_id, boundary_id, boundary_polygon, st
             farmer=Farmer()
         )
         print(f"Farmer with id '{farmer_id}' created.")
-    # Create boundary
-    try:
-        boundary = fb_client.boundaries.get(
-            farmer_id=farmer_id,
-            boundary_id=boundary_id
-        )
+    # Create boundary, only if it is not registered yet with the same geometry, checked with one
+    # boundaries.get so that a boundary deleted outside the manifest is created again
+    sync_result = BoundarySync(fb_client).sync(farmer_id, {boundary_id: boundary_polygon}, verify=True)
+    if boundary_id in sync_result.failed:
+        raise sync_result.failed[boundary_id]
+    boundary = sync_result.boundaries[0]
+    if sync_result.unchanged:
         print(f"Boundary with id '{boundary.id}' exists", end="\n")
-        
-    except ResourceNotFoundError:
-        print(f"Creating boundary with id '{boundary_id}'... ", end="")
-        boundary = fb_client.boundaries.create_or_update(
-            farmer_id=farmer_id,
-            boundary_id=boundary_id,
-            boundary=Boundary(
-                description="Created by SDK",
-                geometry=Polygon(
-                    coordinates=[
-                        boundary_polygon
-                    ]
-                )
-            )
-        )
-        print("Boundary '{}' created".format(boundary.id))
-    except Exception as e:
-        print(e)
+    else:
+        print("Boundary '{}' {}".format(boundary.id, "created" if sync_result.created else "updated"))
 
     # Satelitte job and check status of it
     sat_job_id = "satellitejob"+ str(uuid.uuid1())
@@ -95,6 +90,14 @@ def get_sat_weather_data(fb_client, farmer_id, boundary_id, boundary_polygon, st
         print(e.response.body())
         raise
 
+    # Weather jobs are submitted once per weather cell and date range, for the cell representative,
+    # a recreated boundary lost its weather
+    if sync_result.updated:
+        weather_cache.forget(farmer_id, sync_result.updated)
+    cell = weather_cache.register(farmer_id, boundary_id, boundary_polygon)
+    weather_boundary = weather_cache.get_representative(cell)
+    weather_jobs = {}
+
     # Weather (historical) job and status of it
     extension_id = farmbeats_config["weather_provider_extension_id"]
     extension_data_provider_api_key = farmbeats_config["weather_provider_key"]
@@ -104,60 +107,69 @@ def get_sat_weather_data(fb_client, farmer_id, boundary_id, boundary_polygon, st
     w_hist_job_id = "w-historical" + str(uuid.uuid1())
     st_unix = int(start_dt.timestamp())
     ed_unix = int(end_dt.timestamp())
-    try:
-        print(f"Queuing weather job for boudary '{boundary.id}'. ", end="", flush=True)
-        weather_hist_job = fb_client.weather.begin_create_data_ingestion_job(
-            job_id=w_hist_job_id,
-            job=WeatherDataIngestionJob(
-                farmer_id=boundary.farmer_id,
-                boundary_id=boundary.id,
-                extension_id=extension_id, 
-                extension_api_name=extension_api_name, 
-                extension_api_input={"start": st_unix, "end": ed_unix},
-                extension_data_provider_api_key=extension_data_provider_api_key,
-                extension_data_provider_app_id=extension_data_provider_app_id
-            ),
-            polling=True
-        )
-        print(f"Submitted weather job '{w_hist_job_id}'.")
-    except HttpResponseError as e:
-        print(e.response.body())
-        raise
+    if weather_cache.needs_ingestion(cell, "historical", start_dt, end_dt):
+        try:
+            print(f"Queuing weather job for boudary '{weather_boundary.id}'. ", end="", flush=True)
+            weather_jobs["historical"] = fb_client.weather.begin_create_data_ingestion_job(
+                job_id=w_hist_job_id,
+                job=WeatherDataIngestionJob(
+                    farmer_id=weather_boundary.farmer_id,
+                    boundary_id=weather_boundary.id,
+                    extension_id=extension_id, 
+                    extension_api_name=extension_api_name, 
+                    extension_api_input={"start": st_unix, "end": ed_unix},
+                    extension_data_provider_api_key=extension_data_provider_api_key,
+                    extension_data_provider_app_id=extension_data_provider_app_id
+                ),
+                polling=True
+            )
+            print(f"Submitted weather job '{w_hist_job_id}'.")
+        except HttpResponseError as e:
+            print(e.response.body())
+            raise
+    else:
+        print(f"Weather (historical) of cell '{cell}' is already ingested.")
 
     # Weather (forecast) job and status of it
     extension_api_name = "dailyforecast"
     w_forecast_job_id = "w-forecast"+ str(uuid.uuid1())
     
-    try:
-        print(f"Queuing weather job for boudary '{boundary.id}'. ", end="", flush=True)
-        weather_forecast_job = fb_client.weather.begin_create_data_ingestion_job(
-            job_id=w_forecast_job_id,
-            job=WeatherDataIngestionJob(
-                farmer_id=boundary.farmer_id,
-                boundary_id=boundary.id,
-                extension_id=extension_id,
-                extension_api_name=extension_api_name,
-                extension_api_input={"start": 0, "end": 10},
-                extension_data_provider_api_key=extension_data_provider_api_key,
-                extension_data_provider_app_id=extension_data_provider_app_id
-            ),
-            polling=True
-        )
-        print(f"Submitted weather job '{w_forecast_job_id}'.")
-    except HttpResponseError as e:
-        print(e.response.body())
-        raise
+    if weather_cache.needs_ingestion(cell, "forecast", start_dt, end_dt):
+        try:
+            print(f"Queuing weather job for boudary '{weather_boundary.id}'. ", end="", flush=True)
+            weather_jobs["forecast"] = fb_client.weather.begin_create_data_ingestion_job(
+                job_id=w_forecast_job_id,
+                job=WeatherDataIngestionJob(
+                    farmer_id=weather_boundary.farmer_id,
+                    boundary_id=weather_boundary.id,
+                    extension_id=extension_id,
+                    extension_api_name=extension_api_name,
+                    extension_api_input={"start": 0, "end": 10},
+                    extension_data_provider_api_key=extension_data_provider_api_key,
+                    extension_data_provider_app_id=extension_data_provider_app_id
+                ),
+                polling=True
+            )
+            print(f"Submitted weather job '{w_forecast_job_id}'.")
+        except HttpResponseError as e:
+            print(e.response.body())
+            raise
+    else:
+        print(f"Weather (forecast) of cell '{cell}' is already ingested.")
 
-    # Wait for all 3 jobs
+    # Wait for all jobs
     print('Waiting for all jobs to complete')
     satellite_job.result()
-    weather_hist_job.result()
-    weather_forecast_job.result()
+    for weather_job in weather_jobs.values():
+        weather_job.result()
 
     # Status of Jobs and raise error if any job fails
     print(f"Satellite job '{satellite_job.result().as_dict()['id']}' {satellite_job.status()}.")
-    print(f"Weather job '{weather_hist_job.result().as_dict()['id']}' {weather_hist_job.status()}.")
-    print(f"Weather job '{weather_forecast_job.result().as_dict()['id']}' {weather_forecast_job.status()}.")
+    for weather_data_type, weather_job in weather_jobs.items():
+        print(f"Weather job '{weather_job.result().as_dict()['id']}' {weather_job.status()}.")
+        if weather_job.status() == "Succeeded":
+            weather_cache.mark_ingested(cell, weather_data_type, start_dt, end_dt)
+    return boundary
 
 def get_timezone(boundary_geometry: list):
     """
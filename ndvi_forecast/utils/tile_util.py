@@ -0,0 +1,77 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+# Third party imports
+import numpy as np
+import pandas as pd
+from rasterio.windows import Window
+
+
+class TileUtil:
+    """
+    Helper methods to split a boundary raster into tiles and
+    stitch per pixel predictions back into rasters.
+    """
+
+
+    @staticmethod
+    def get_tile_windows(height: int, width: int, tile_size: int, sat_res_x: int = 1) -> list:
+        """
+        Splits a raster extent into row major tiles.
+        :param int height: raster height in pixels
+        :param int width: raster width in pixels
+        :param int tile_size: tile width and height in pixels
+        :param int sat_res_x: spatial sampling, tile_size is rounded up to a multiple of it
+            so that the sampled pixels are the same as for the whole raster
+        :return: list of rasterio Windows
+        """
+        if tile_size <= 0:
+            raise ValueError("tile_size must be positive, but provided: {}".format(tile_size))
+        tile_size = int(np.ceil(tile_size / sat_res_x) * sat_res_x)
+        return [
+            Window(col_off, row_off, min(tile_size, width - col_off), min(tile_size, height - row_off))
+            for row_off in range(0, height, tile_size)
+            for col_off in range(0, width, tile_size)
+        ]
+
+
+    @staticmethod
+    def pixel_index(lat, long, transform) -> tuple:
+        """
+        Returns raster row and column indexes for pixel coordinates as produced by ard_preprocess,
+        i.e. upper left pixel corners derived from the transform.
+        """
+        rows = np.rint((np.asarray(lat, dtype=float) - transform.f) / transform.e).astype(int)
+        cols = np.rint((np.asarray(long, dtype=float) - transform.c) / transform.a).astype(int)
+        return rows, cols
+
+
+    @staticmethod
+    def stitch_predictions(pred_df: "DataFrame", label_names: list, raster: np.ndarray, transform) -> np.ndarray:
+        """
+        Writes per pixel predictions (one column per forecast day, plus lat and long) into
+        a (output_days, height, width) raster in place. Pixels outside the raster are ignored.
+        :param pred_df: predictions with label_names, lat and long columns
+        :param raster: output raster, usually initialized with NaN
+        :param transform: affine transform of the output raster
+        :return: raster
+        """
+        rows, cols = TileUtil.pixel_index(pred_df.lat.values, pred_df.long.values, transform)
+        inside = (rows >= 0) & (rows < raster.shape[1]) & (cols >= 0) & (cols < raster.shape[2])
+        raster[:, rows[inside], cols[inside]] = pred_df[label_names].values[inside].T
+        return raster
+
+
+    @staticmethod
+    def raster_to_pred_df(raster: np.ndarray, label_names: list, transform) -> "DataFrame":
+        """
+        Converts a (output_days, height, width) raster to the prediction DataFrame layout,
+        one row per pixel in row major order with lat and long columns.
+        """
+        _, height, width = raster.shape
+        rows, cols = np.mgrid[0:height, 0:width]
+        pred_df = pd.DataFrame(raster.reshape(len(label_names), -1).T, columns=label_names)
+        return pred_df.assign(
+            lat=transform.f + transform.e * rows.ravel(),
+            long=transform.c + transform.a * cols.ravel(),
+        )
@@ -0,0 +1,348 @@
+# Copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license.
+
+# Standard library imports
+import hashlib
+import json
+import math
+import os
+from collections import OrderedDict
+from threading import Lock
+
+try:
+    import fcntl
+except ImportError:  # Windows, the index is then only locked within the process
+    fcntl = None
+
+# Third party imports
+import pandas as pd
+from shapely import geometry
+
+# Local imports
+from utils.boundary_sync import BoundaryRef, get_client_endpoint
+from utils.config import farmbeats_config
+from utils.constants import CONSTANTS
+from utils.io_utils import IOUtil
+from utils.weather_util import WeatherUtil
+
+
+class WeatherCache:
+    """
+    Weather shared by the boundaries of a spatial cell. Each boundary centroid is mapped
+    to a square cell of cell_size_deg degrees (about the weather provider grid), and the
+    first boundary registered in a cell is its representative: weather is ingested and
+    listed for the representative only, normalized once per cell, data type and date
+    range, and stored as csv. Cells and ingested date ranges are kept in weather_cells.json,
+    so notebooks and the scoring service share them: each change is applied to the file
+    under a file lock, and lookups missing in memory reload it. Weather without a start
+    and end date (e.g. the latest forecast) is only kept in memory.
+
+    Files are kept in a folder of cache_dir per FarmBeats endpoint and weather extension,
+    so representatives and weather are never shared between instances or providers.
+    A boundary which moves to another cell, or is forgotten (e.g. recreated by BoundarySync,
+    which deletes its weather), hands the representative role of its old cell to another
+    boundary of the cell, and the cell's weather is ingested again.
+
+    weather_cache = WeatherCache(endpoint=farmbeats_config["instance_url"])
+    weather_cache.register(farmer_id, boundary_id, boundary_polygon)
+    w_df = weather_cache.get_weather_df(fb_client, farmer_id, boundary_id, "historical", start_dt, end_dt)
+    """
+
+    def __init__(self, cache_dir=None, cell_size_deg=None, extension_id=None, max_size=256, endpoint=None):
+        """
+        :param cache_dir: folder of the cell indexes and weather csv files, defaults to weather_cache in the root dir
+        :param cell_size_deg: cell side in degrees, defaults to CONSTANTS["weather_cell_deg"]
+        :param extension_id: weather provider extension id, from farmbeats_config if not given
+        :param max_size: weather DataFrames kept in memory, least recently used ones are evicted
+        :param endpoint: FarmBeats endpoint whose boundaries are registered, from farmbeats_config if not given
+        """
+        self.cell_size_deg = cell_size_deg or CONSTANTS["weather_cell_deg"]
+        self.extension_id = extension_id or farmbeats_config["weather_provider_extension_id"]
+        self.endpoint = endpoint if endpoint is not None else farmbeats_config["instance_url"]
+        self.cache_dir = os.path.join(
+            cache_dir or os.path.join(CONSTANTS["root_dir"], "weather_cache"),
+            self.get_scope(self.endpoint, self.extension_id),
+        )
+        self.max_size = max_size
+        self.index_path = os.path.join(self.cache_dir, "weather_cells.json")
+        self._frames = OrderedDict()
+        self._lock = Lock()
+        self._fetch_locks = {}  # key: [lock, number of callers holding or waiting for it]
+        self.index = self._load_index()
+
+
+    @staticmethod
+    def get_scope(endpoint: str, extension_id: str) -> str:
+        """ Returns the folder name of a FarmBeats endpoint and weather extension """
+        return hashlib.sha1("{}|{}".format(endpoint, extension_id).encode()).hexdigest()[:16]
+
+
+    @staticmethod
+    def get_cell(boundary_polygon: list, cell_size_deg: float) -> str:
+        """
+        Returns the cell of the boundary centroid, e.g. "0.05_933_-1942" for row 933 and column -1942
+        of a 0.05 degree grid
+        :param boundary_polygon: polygon ring as list of [longitude, latitude]
+        """
+        lng_centroid, lat_centroid = geometry.Polygon(boundary_polygon).centroid.coords[0]
+        return "{:g}_{:d}_{:d}".format(
+            cell_size_deg,
+            int(math.floor(lat_centroid / cell_size_deg)),
+            int(math.floor(lng_centroid / cell_size_deg)),
+        )
+
+
+    def register(self, farmer_id: str, boundary_id: str, boundary_polygon: list) -> str:
+        """
+        Maps a boundary to its cell, the boundary becomes the cell representative if the cell has none.
+        :return: cell
+        """
+        cell = self.get_cell(boundary_polygon, self.cell_size_deg)
+        if self._find_cell(farmer_id, boundary_id) != cell or cell not in self.index["representatives"]:
+            self._update_index(lambda index: self._assign_cells(index, farmer_id, {boundary_id: cell}))
+        return cell
+
+
+    def register_boundaries(self, farmer_id: str, boundaries: dict) -> list:
+        """
+        Registers boundaries (dict of boundary id to polygon ring) and returns the
+        representatives of their cells, as BoundaryRef, to ingest weather for
+        """
+        cells = OrderedDict(
+            (boundary_id, self.get_cell(boundary_polygon, self.cell_size_deg))
+            for boundary_id, boundary_polygon in boundaries.items()
+        )
+        self._update_index(lambda index: self._assign_cells(index, farmer_id, cells))
+        return [self.get_representative(x) for x in OrderedDict.fromkeys(cells.values())]
+
+
+    def forget(self, farmer_id: str, boundary_ids):
+        """
+        Removes boundaries from their cells, e.g. boundaries recreated by BoundarySync whose weather
+        was deleted. A cell whose representative is removed gets another one, and needs ingestion again.
+        """
+        def remove(index):
+            for boundary_id in boundary_ids:
+                self._remove_boundary(index, farmer_id, boundary_id)
+
+        self._update_index(remove)
+
+
+    def invalidate(self, cell=None):
+        """ Drops the ingested date ranges and cached weather of a cell, or of all cells if no cell is given """
+        def remove(index):
+            for key in [x for x in index["ingested"] if cell is None or x.startswith(cell + "_")]:
+                del index["ingested"][key]
+
+        self._update_index(remove)
+        with self._lock:
+            for key in [x for x in self._frames if cell is None or x.startswith(cell + "_")]:
+                del self._frames[key]
+        if os.path.exists(self.cache_dir):
+            for file_name in os.listdir(self.cache_dir):
+                if file_name.endswith(".csv") and (cell is None or file_name.startswith(cell + "_")):
+                    IOUtil.delete_file_safely(os.path.join(self.cache_dir, file_name))
+
+
+    def get_cell_of(self, farmer_id: str, boundary_id: str) -> str:
+        """ Returns the cell of a registered boundary """
+        cell = self._find_cell(farmer_id, boundary_id)
+        if cell is None:
+            raise ValueError("Boundary '{}' is not registered in the weather cache".format(boundary_id))
+        return cell
+
+
+    def get_representative(self, cell: str) -> BoundaryRef:
+        """ Returns the boundary whose weather is used for the cell """
+        return BoundaryRef(*self.index["representatives"][cell])
+
+
+    def needs_ingestion(self, cell: str, weather_data_type: str, start_dt, end_dt) -> bool:
+        """ Returns True if no weather ingestion job succeeded yet for the cell, data type and date range """
+        key = self._get_key(cell, weather_data_type, start_dt, end_dt)
+        if key not in self.index["ingested"]:
+            # another process may have ingested it
+            self._reload_index()
+        return key not in self.index["ingested"]
+
+
+    def mark_ingested(self, cell: str, weather_data_type: str, start_dt, end_dt):
+        """ Records a succeeded weather ingestion job of the cell representative """
+        key = self._get_key(cell, weather_data_type, start_dt, end_dt)
+        self._update_index(lambda index: index["ingested"].update({key: True}))
+
+
+    def has_weather(self, farmer_id: str, boundary_id: str, weather_data_type: str, start_dt=None, end_dt=None) -> bool:
+        """ Returns True if the weather of the boundary cell is cached in memory or on disk """
+        cell = self._find_cell(farmer_id, boundary_id)
+        if cell is None:
+            return False
+        key = self._get_key(cell, weather_data_type, start_dt, end_dt)
+        return key in self._frames or (self._is_persisted(start_dt, end_dt) and os.path.exists(self._get_path(key)))
+
+
+    def get_weather_df(
+        self, fb_client, farmer_id, boundary_id, weather_data_type, start_dt=None, end_dt=None, granularity="daily"
+    ) -> "DataFrame":
+        """
+        Returns the normalized weather of the boundary cell (as WeatherUtil.get_weather_data_df),
+        listed from FarmBeats for the cell representative on a cache miss (its boundaryId column
+        is the representative's).
+        :param fb_client: FarmBeats client of the cache endpoint, may be None when the weather is cached
+        :param weather_data_type: "historical" or "forecast"
+        :param start_dt: start date of the weather, all ingested weather if not given
+        :param end_dt: end date of the weather, weather without both dates is not written to disk
+            as it changes over time
+        :return: DataFrame, None if no weather is available
+        """
+        client_endpoint = get_client_endpoint(fb_client)
+        if client_endpoint and client_endpoint != self.endpoint:
+            raise ValueError(
+                "FarmBeats client of '{}' given to the weather cache of '{}'".format(client_endpoint, self.endpoint)
+            )
+        cell = self.get_cell_of(farmer_id, boundary_id)
+        key = self._get_key(cell, weather_data_type, start_dt, end_dt)
+        persisted = self._is_persisted(start_dt, end_dt)
+        with self._lock:
+            fetch_lock = self._fetch_locks.setdefault(key, [Lock(), 0])
+            fetch_lock[1] += 1
+        # concurrent requests for the same cell wait for one fetch, the lock is
+        # removed by the last of them
+        try:
+            with fetch_lock[0]:
+                w_df = self._get_frame(key)
+                if w_df is None and persisted and os.path.exists(self._get_path(key)):
+                    w_df = pd.read_csv(self._get_path(key))
+                    self._put_frame(key, w_df)
+                if w_df is None:
+                    w_df = self._fetch(fb_client, cell, weather_data_type, start_dt, end_dt, granularity)
+                    if w_df is None:
+                        return None
+                    if persisted:
+                        IOUtil.write_file_atomically(self._get_path(key), lambda x: w_df.to_csv(x, index=False))
+                    self._put_frame(key, w_df)
+        finally:
+            with self._lock:
+                fetch_lock[1] -= 1
+                if fetch_lock[1] == 0:
+                    del self._fetch_locks[key]
+        return w_df.copy()
+
+
+    def _fetch(self, fb_client, cell, weather_data_type, start_dt, end_dt, granularity):
+        if fb_client is None:
+            raise ValueError("Weather of cell '{}' is not cached and no FarmBeats client is given".format(cell))
+        representative = self.get_representative(cell)
+        weather_list = fb_client.weather.list(
+            farmer_id=representative.farmer_id,
+            boundary_id=representative.id,
+            start_date_time=start_dt,
+            end_date_time=end_dt,
+            extension_id=self.extension_id,
+            weather_data_type=weather_data_type,
+            granularity=granularity,
+        )
+        return WeatherUtil.get_weather_data_df(list(weather_list))
+
+
+    def _get_frame(self, key):
+        with self._lock:
+            w_df = self._frames.pop(key, None)
+            if w_df is not None:
+                self._frames[key] = w_df
+            return w_df
+
+
+    def _put_frame(self, key, w_df):
+        with self._lock:
+            self._frames[key] = w_df
+            while len(self._frames) > self.max_size:
+                self._frames.popitem(last=False)
+
+
+    def _find_cell(self, farmer_id, boundary_id):
+        """ Returns the cell of the boundary, reloading the index once if it is not found, None if not registered """
+        cell = self.index["boundaries"].get(farmer_id, {}).get(boundary_id)
+        if cell is None:
+            self._reload_index()
+            cell = self.index["boundaries"].get(farmer_id, {}).get(boundary_id)
+        return cell
+
+
+    @staticmethod
+    def _assign_cells(index, farmer_id, cells):
+        """ Maps boundaries (dict of boundary id to cell) to their cells, removing moved boundaries from their old cell """
+        boundaries = index["boundaries"].setdefault(farmer_id, {})
+        for boundary_id, cell in cells.items():
+            if boundaries.get(boundary_id, cell) != cell:
+                WeatherCache._remove_boundary(index, farmer_id, boundary_id)
+            boundaries[boundary_id] = cell
+            index["representatives"].setdefault(cell, [farmer_id, boundary_id])
+
+
+    @staticmethod
+    def _remove_boundary(index, farmer_id, boundary_id):
+        """
+        Removes a boundary from its cell. If it was the representative, another boundary of the cell
+        (if any) becomes it, and the ingested date ranges of the cell are dropped, as they were ingested
+        for the removed boundary.
+        """
+        cell = index["boundaries"].get(farmer_id, {}).pop(boundary_id, None)
+        if cell is None or index["representatives"].get(cell) != [farmer_id, boundary_id]:
+            return
+        del index["representatives"][cell]
+        for key in [x for x in index["ingested"] if x.startswith(cell + "_")]:
+            del index["ingested"][key]
+        for other_farmer_id, boundaries in index["boundaries"].items():
+            other_boundary_id = next((x for x, y in boundaries.items() if y == cell), None)
+            if other_boundary_id is not None:
+                index["representatives"][cell] = [other_farmer_id, other_boundary_id]
+                return
+
+
+    @staticmethod
+    def _is_persisted(start_dt, end_dt) -> bool:
+        return start_dt is not None and end_dt is not None
+
+
+    @staticmethod
+    def _get_key(cell, weather_data_type, start_dt, end_dt) -> str:
+        dates = [x.strftime("%Y-%m-%d") if x is not None else "all" for x in (start_dt, end_dt)]
+        return "_".join([cell, weather_data_type] + dates)
+
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, key + ".csv")
+
+
+    def _load_index(self) -> dict:
+        if not os.path.exists(self.index_path):
+            return {"boundaries": {}, "representatives": {}, "ingested": {}}
+        with open(self.index_path) as f:
+            return json.load(f)
+
+
+    def _reload_index(self):
+        index = self._load_index()
+        with self._lock:
+            self.index = index
+
+
+    def _update_index(self, update):
+        """
+        Applies update(index) to the index file under a file lock, so changes of other processes
+        are kept, and uses the result as self.index
+        """
+        def write(file_path):
+            with open(file_path, "w") as f:
+                json.dump(index, f)
+
+        IOUtil.create_dir_safely(self.cache_dir)
+        with open(self.index_path + ".lock", "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            with self._lock:
+                index = self._load_index()
+                update(index)
+                IOUtil.write_file_atomically(self.index_path, write)
+                self.index = index